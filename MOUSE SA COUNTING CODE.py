@@ -1,108 +1,141 @@
+import argparse
+import csv
 import os
-import pandas as pd
+
+from sa_bridge import bridge_to_file, csv_stream, events_stream, pair_halves, write_counts
+from sa_counts import binned_counts, box_times_from_streams, make_bins, parse_windows, window_label
+from sa_columnar import EVENT_EXTENSIONS, read_events
+from sa_io import atomic_path
+from sa_manifest import Manifest
+from sa_report import FileStats, RunReport
 
 # User-defined filter times
 start_time = 0  # Specify start time in minutes (e.g., 30 minutes)
 end_time = 180   # Specify end time in minutes (e.g., 180 minutes)
 
+# Read the typed event files in EVENTS (written with --events-format) instead of
+# the FINALOUTPUT CSVs
+use_events = False
+
+# Optional extra windows, counted for every box and session in one pass
+# (written to Binned_Counts.csv), e.g.:
+#   --bin-width 10            -> 10-minute bins from start_time to end_time
+#   --windows 0-60,60-180     -> first hour vs the rest
+parser = argparse.ArgumentParser(description="Bridge the 1-8 and 9-16 halves and count events per box.")
+parser.add_argument('--bin-width', type=float, action='append', default=[],
+                    help="count events in bins of this many minutes (repeatable)")
+parser.add_argument('--windows', help="count events in these windows, e.g. '0-60,60-180'")
+parser.add_argument('--report', action='append', default=[],
+                    help="save a run report (timings, sizes, skipped/failed files) to this "
+                         ".json or .csv path (repeatable)")
+args = parser.parse_args()
+
+windows = []
+if args.windows:
+    windows.extend(parse_windows(args.windows))
+for bin_width in args.bin_width:
+    windows.extend(make_bins(bin_width, end_time, start_time))
+
 # Directories
 bridged_final_output_dir = r'C:\Users\oddon\OneDrive\SAD\BRIDGEDFINALOUTPUT'
 os.makedirs(bridged_final_output_dir, exist_ok=True)
 final_output_dir = r'C:\Users\oddon\OneDrive\SAD\FINALOUTPUT'
+events_dir = r'C:\Users\oddon\OneDrive\SAD\EVENTS'
+
+# Manifest shared with the processing script: a base whose two FINALOUTPUT files,
+# time window and bridged file are unchanged reuses its cached counts row.
+manifest = Manifest(r'C:\Users\oddon\OneDrive\SAD\processing_manifest.json')
+params = {'start_time': start_time, 'end_time': end_time, 'use_events': use_events,
+          'bridge': 'merge'}
+
+# Timings, sizes and skipped/failed bases of this run (see sa_report)
+report = RunReport('MOUSE SA COUNTING CODE', dict(params, windows=[list(w) for w in windows]))
 
-# Prepare a DataFrame to collect the counts
-final_counts = pd.DataFrame()
+# Collect one counts row per base name (and per-box event times for the windows)
+count_rows = []
+binned_bases = []
+binned_times = []
 
 # Group files by their base name (assumes files from the nine–16 run have '_9-16' in their name)
-files_by_base = {}
-for file_name in os.listdir(final_output_dir):
-    if file_name.lower().endswith('.csv'):
-        if '_9-16' in file_name:
-            base = file_name.replace('_9-16', '')
-            base = os.path.splitext(base)[0]
-        else:
-            base = os.path.splitext(file_name)[0]
-        files_by_base.setdefault(base, []).append(file_name)
-
-for base, files in files_by_base.items():
-    if len(files) == 2:
-        # Identify the base file (boxes 1–8) and its nine–16 counterpart.
-        base_file = next((f for f in files if '_9-16' not in f), None)
-        nine_file = next((f for f in files if '_9-16' in f), None)
-        if not (base_file and nine_file):
-            print(f"Skipping base '{base}' because files don't match the expected pattern.")
-            continue
-
-        # Read and rename the base file columns
-        base_path = os.path.join(final_output_dir, base_file)
-        df_base = pd.read_csv(base_path)
-        
-        # Ensure the Absolute Time column is numeric
-        df_base[df_base.columns[0]] = pd.to_numeric(df_base[df_base.columns[0]], errors='coerce')
-
-        # We expect df_base to have 9 columns: the first for Absolute Time and 8 for boxes 1–8.
-        if len(df_base.columns) >= 9:
-            new_base_columns = [df_base.columns[0]] + [f"Box {i}" for i in range(1, 9)]
-            df_base = df_base.iloc[:, :9]  # keep only the expected columns
-            df_base.columns = new_base_columns
-            # Remove duplicates within the base file
-            df_base = df_base.drop_duplicates()
-
-            # Filter data for the specified time range [start_time, end_time]
-            df_base_filtered = df_base[(df_base[df_base.columns[0]] >= start_time) & (df_base[df_base.columns[0]] <= end_time)]
-        else:
-            print(f"Base file {base_file} does not have enough columns.")
-            continue
-
-        # Read and rename the nine–16 file columns
-        nine_path = os.path.join(final_output_dir, nine_file)
-        df_nine = pd.read_csv(nine_path)
-        
-        # Ensure the Absolute Time column is numeric
-        df_nine[df_nine.columns[0]] = pd.to_numeric(df_nine[df_nine.columns[0]], errors='coerce')
-
-        # We expect df_nine to have 9 columns: the first for Absolute Time and 8 for boxes 9–16.
-        if len(df_nine.columns) >= 9:
-            new_nine_columns = [df_nine.columns[0]] + [f"Box {i}" for i in range(9, 17)]
-            df_nine = df_nine.iloc[:, :9]
-            df_nine.columns = new_nine_columns
-            # Remove duplicates within the nine–16 file
-            df_nine = df_nine.drop_duplicates()
-
-            # Filter data for the specified time range [start_time, end_time]
-            df_nine_filtered = df_nine[(df_nine[df_nine.columns[0]] >= start_time) & (df_nine[df_nine.columns[0]] <= end_time)]
-        else:
-            print(f"Nine file {nine_file} does not have enough columns.")
-            continue
-
-        # Merge the two DataFrames on the "Absolute Time (minutes)" column.
-        merged_df = pd.merge(df_base_filtered, df_nine_filtered, on=df_base.columns[0], how="outer")
-        merged_df.sort_values(by=df_base.columns[0], ascending=True, inplace=True)
-        # Remove any fully duplicated rows after sorting
-        merged_df.drop_duplicates(inplace=True)
-
-        # Count the number of 1's in each Box column (excluding 'Absolute Time' column)
-        box_columns = merged_df.columns[1:]  # excluding the first column (Absolute Time)
-        counts = (merged_df[box_columns] == 1).sum()
-
-        # Prepare the results for this file
-        counts_series = pd.Series(counts, name=base)
-
-        # Add the file name as the first column
-        counts_series = counts_series.to_frame().T
-        counts_series.insert(0, 'File Name', base)  # Insert the file name in the first column
-
-        # Concatenate the counts to the final counts DataFrame
-        final_counts = pd.concat([final_counts, counts_series], ignore_index=True)
-
-        # Save the bridged file
-        bridged_file_path = os.path.join(bridged_final_output_dir, base + '.csv')
-        merged_df.to_csv(bridged_file_path, index=False)
-        print(f"Bridged file saved to {bridged_file_path}")
-
-# After processing all files, set column names for final_counts (Box 1 to Box 16)
-final_counts.columns = ['File Name'] + [f"Box {i}" for i in range(1, 17)]
-
-# Save the final counts to a CSV file
-final_counts.to_csv(os.path.join(bridged_final_output_dir, 'Final_Counts.csv'), index=False)
-print(f"Final counts saved to {os.path.join(bridged_final_output_dir, 'Final_Counts.csv')}")
+source_dir = events_dir if use_events else final_output_dir
+source_extensions = EVENT_EXTENSIONS if use_events else ('.csv',)
+pairs = pair_halves(source_dir, source_extensions)
+
+def open_streams(base_path, nine_path):
+    if use_events:
+        return [events_stream(read_events(base_path)), events_stream(read_events(nine_path))]
+    return [csv_stream(base_path, 8), csv_stream(nine_path, 8)]
+
+
+for base, (base_file, nine_file) in pairs.items():
+    base_path = os.path.join(source_dir, base_file)
+    nine_path = os.path.join(source_dir, nine_file)
+    if windows:
+        stats = FileStats(base)
+        try:
+            with stats.stage('windows'):
+                binned_times.append(box_times_from_streams(open_streams(base_path, nine_path), [8, 8]))
+            binned_bases.append(base)
+            stats.read(base_path)
+            stats.read(nine_path)
+            report.add_file(stats)
+        except ValueError as e:
+            print(f"Skipping windowed counts for base '{base}'. Error: {e}")
+            report.fail(base, 'windows', str(e))
+
+    bridged_file_path = os.path.join(bridged_final_output_dir, base + '.csv')
+    if manifest.is_current('counts', base, [base_path, nine_path], params, [bridged_file_path]):
+        print(f"Unchanged, reusing counts for {base}")
+        report.skip(base, 'bridge', 'unchanged since the last run, counts reused')
+        count_rows.append([base] + manifest.get('counts', base)['counts'])
+        continue
+
+    # Both halves are sorted by Absolute Time: merge them in one pass over the
+    # time window [start_time, end_time], counting the 1's per box (Box 1-8 from
+    # the base file, Box 9-16 from the nine–16 file) and writing the bridged
+    # file as it goes.
+    stats = FileStats(base)
+    try:
+        with stats.stage('bridge'):
+            counts = bridge_to_file(open_streams(base_path, nine_path), [8, 8], bridged_file_path,
+                                    start_time, end_time)
+    except ValueError as e:
+        print(f"Skipping base '{base}'. Error: {e}")
+        report.fail(base, 'bridge', str(e))
+        continue
+    print(f"Bridged file saved to {bridged_file_path}")
+    stats.read(base_path)
+    stats.read(nine_path)
+    stats.wrote(bridged_file_path)
+    stats.events_per_box = counts
+    report.add_file(stats)
+
+    # Prepare the results for this file, with the file name as the first column
+    count_rows.append([base] + counts)
+    manifest.record('counts', base, [base_path, nine_path], params, [bridged_file_path],
+                    counts=counts)
+
+# After processing all files, save the final counts (Box 1 to Box 16) in one write
+final_counts_path = os.path.join(bridged_final_output_dir, 'Final_Counts.csv')
+write_counts(final_counts_path, count_rows)
+print(f"Final counts saved to {final_counts_path}")
+
+# Counts in every extra window: a (session x box x window) array, written one row
+# per session and window
+if windows:
+    binned = binned_counts(binned_times, windows)
+    binned_counts_path = os.path.join(bridged_final_output_dir, 'Binned_Counts.csv')
+    with atomic_path(binned_counts_path) as temp_path:
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['File Name', 'Window (minutes)'] + [f"Box {i}" for i in range(1, 17)])
+            for s, base in enumerate(binned_bases):
+                for w, window in enumerate(windows):
+                    writer.writerow([base, window_label(window)] +
+                                    [int(binned[s][b][w]) for b in range(16)])
+    print(f"Binned counts saved to {binned_counts_path}")
+manifest.save()
+
+print(report.summary())
+for report_path in args.report:
+    report.save(report_path)
@@ -1,155 +1,299 @@
+import argparse
 import csv
-import pandas as pd
+import io
 import os
 
-def run_raster_plot_parsing():
+from medpc_index import parse_where
+from medpc_parser import parse_medpc_file, ticks_to_minutes
+from medpc_stream import AlignedStream, write_tables
+from sa_batch import run_batch
+from sa_columnar import write_events
+from sa_io import DEFAULT_IN_FLIGHT, atomic_path, prefetched, run_overlapped, write_file
+from sa_report import FileStats, RunReport, print_profiles, profile_call
+from sa_watch import watch_folders
+
+
+# -- Folders (adjust as needed) ------------------------------------------------
+base_input_dir = r'C:\Users\oddon\OneDrive\SAD\RATSA RAW'         # Where the raw files are
+output_directory = r'C:\Users\oddon\OneDrive\SAD\SA Data to process'
+final_output_dir = r'C:\Users\oddon\OneDrive\SAD\RATSA FINAL'
+events_dir = r'C:\Users\oddon\OneDrive\SAD\RATSA EVENTS'
+
+FINAL_HEADERS = ['Absolute Time (minutes)'] + [f'Box {i+1}' for i in range(16)]
+
+
+# -- Helper function: Write one aligned table ---------------------------------
+def write_aligned(path, all_ticks, box_codes, marker):
+    """Writes the table atomically (see sa_io.write_file); returns its size."""
+    csvfile = io.StringIO()
+    writer = csv.writer(csvfile)
+    writer.writerow(FINAL_HEADERS)
+    for row_index, tick in enumerate(all_ticks):
+        # Put the marker if we have an event, else blank
+        writer.writerow([ticks_to_minutes(tick)] +
+                        ['' if box_codes[i][row_index] is None else marker[i] for i in range(16)])
+    return write_file(path, csvfile.getvalue())
+
+
+def aligned_row(tick, codes, marker):
+    return [ticks_to_minutes(tick)] + ['' if codes[i] is None else marker[i] for i in range(16)]
+
+
+# -- One session file, streamed (for very long or multi-day sessions) ----------
+def stream_session_file(input_file, final_file_path, aligned_csv_path=None, where=None):
+    """
+    Writes the '_final.csv' (and the aligned CSV) straight from the raw file
+    in one pass, with memory that does not grow with the session (see
+    medpc_stream).  The files are the same as process_session_file writes.
+    Returns the number of events decoded per box.
+    """
+    with AlignedStream(input_file, n_boxes=16, fractions=(1,), where=where) as stream:
+        # A box column with any blank cell is written as floats, as before.
+        marker = [1 if full else 1.0 for full in stream.always([(i, (1,)) for i in range(16)])]
+        tables = [(final_file_path, FINAL_HEADERS,
+                   lambda tick, codes, _: aligned_row(tick, codes, marker))]
+        if aligned_csv_path is not None:
+            tables.append((aligned_csv_path, FINAL_HEADERS,
+                           lambda tick, codes, _: aligned_row(tick, codes, [1] * 16)))
+        write_tables(stream.rows(), tables)
+        return stream.events_per_box
+
+
+# -- One session file (module level so batch workers can run it) --------------
+def process_session_file(input_file, final_output_dir, output_directory,
+                         keep_intermediate=False, events_path=None, profile_path=None,
+                         where=None, streaming=False, catalog_path=None):
+    """
+    Parses one raw file (fraction=1 events, up to 16 boxes) and writes its
+    '_final.csv', plus a sparse event file at 'events_path' if one is given
+    (see sa_columnar).  Returns the path of the final CSV and a FileStats with
+    the time of each step (see sa_report).  With 'profile_path' the parse runs
+    under cProfile and its stats are dumped there.  'where' keeps only the
+    boxes whose header fields match (see parse_medpc_file).  With 'streaming'
+    the file is streamed instead of loaded (stream_session_file).  With
+    'catalog_path' the session is also loaded into that session catalog (see
+    sa_catalog).
+    """
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    stats = FileStats.for_input(input_file)
+
+    if streaming:
+        final_file_path = os.path.join(final_output_dir, base_name + '_final.csv')
+        aligned_csv_path = None
+        if keep_intermediate:
+            aligned_csv_path = os.path.join(output_directory, base_name + '_aligned.csv')
+        with stats.stage('stream'):
+            if profile_path:
+                stats.events_per_box = profile_call(profile_path, stream_session_file, input_file,
+                                                    final_file_path, aligned_csv_path, where)
+            else:
+                stats.events_per_box = stream_session_file(input_file, final_file_path,
+                                                           aligned_csv_path, where)
+        stats.wrote(final_file_path)
+        if aligned_csv_path is not None:
+            stats.wrote(aligned_csv_path)
+            print(f"Aligned data for fraction=1 (16 boxes) written to {aligned_csv_path}")
+        print(f"Final output saved to {final_file_path}")
+        return final_file_path, stats
+
+    # 1-2) Parse the raw file for up to 16 boxes, but only record fraction=1 events
+    #    (times kept as integer 10 ms ticks until they are written)
+    with stats.stage('parse'):
+        if profile_path:
+            session = profile_call(profile_path, parse_medpc_file, input_file,
+                                   n_boxes=16, fractions=(1,), where=where,
+                                   data=prefetched(input_file))
+        else:
+            session = parse_medpc_file(input_file, n_boxes=16, fractions=(1,), where=where,
+                                       data=prefetched(input_file))
+    stats.events_per_box = [len(ticks) for ticks in session.ticks]
+    if events_path is not None:
+        with stats.stage('events'):
+            with atomic_path(events_path) as temp_path:
+                write_events(session, temp_path)
+        stats.wrote(events_path)
+        print(f"Event table saved to {events_path}")
+    if catalog_path is not None:
+        from sa_catalog import Catalog  # only with --catalog
+
+        with stats.stage('catalog'):
+            with Catalog(catalog_path) as catalog:
+                catalog.add_session(input_file, session, 'rat', None, where)
+        print(f"Session loaded into the catalog {catalog_path}")
+
+    # 3) Create a single table: "Absolute Time (minutes), Box 1, ..., Box 16"
+    #    Only times for fraction=1 will appear.
+    with stats.stage('align'):
+        all_ticks, box_codes = session.align()
+
+    if keep_intermediate:
+        aligned_csv_path = os.path.join(output_directory, base_name + '_aligned.csv')
+        with stats.stage('aligned'):
+            size = write_aligned(aligned_csv_path, all_ticks, box_codes, [1] * 16)
+        stats.wrote(aligned_csv_path, size)
+        print(f"Aligned data for fraction=1 (16 boxes) written to {aligned_csv_path}")
+
+    # 4) Final copy, written directly.  The old pandas round-trip wrote a
+    #    box column as floats ('1.0') whenever it had any blank cell; keep that.
+    marker = [1.0 if None in codes else 1 for codes in box_codes]
+    final_file_path = os.path.join(final_output_dir, base_name + '_final.csv')
+    with stats.stage('final'):
+        size = write_aligned(final_file_path, all_ticks, box_codes, marker)
+    stats.wrote(final_file_path, size)
+
+    print(f"Final output saved to {final_file_path}")
+    return final_file_path, stats
+
+
+def run_raster_plot_parsing(keep_intermediate=False, workers=1, events_format=None,
+                            report=None, profile_dir=None, input_files=None, where=None,
+                            streaming=False, in_flight=0, catalog_path=None):
     """
     Processes a single data file (with up to 16 boxes in "C:" sections) by:
-      1. Converting the file to a tab-delimited TXT.
+      1. Streaming the raw file once (no intermediate TXT copy).
       2. Parsing only fraction=1 events (ignoring fraction=2 or 6).
       3. Creating a single CSV with columns:
          [Absolute Time (minutes), Box 1, Box 2, ..., Box 16].
       4. Each box column has '1' if fraction=1 occurred, otherwise blank.
+
+    With 'keep_intermediate' the aligned CSV is also written to the
+    'SA Data to process' folder, as before.  'workers' > 1 spreads the files
+    across that many processes.  'events_format' ('npz', 'parquet' or
+    'feather') also writes each file's events to 'RATSA EVENTS'.
+
+    Timings, sizes and failed files go to 'report' (a RunReport) if one is
+    given; with 'profile_dir' each file's parse is profiled into
+    '<name>.prof' there.  'input_files' limits the run to those raw files
+    (watch mode); by default every file in the raw folder is processed.
+    'where' keeps only the boxes whose header fields match.  'streaming'
+    streams every file from disk (flat memory for very long sessions; no
+    event files).  'in_flight' > 0 reads the next files ahead and writes the
+    outputs in the background, with at most that many files in flight (see
+    sa_io).  'catalog_path' also loads every session into that session
+    catalog (see sa_catalog).
     """
+    if streaming and events_format:
+        raise ValueError("Event files need whole sessions in memory; "
+                         "they cannot be written in streaming mode")
+    if streaming and in_flight:
+        raise ValueError("Streaming mode reads and writes as it goes; it cannot be combined "
+                         "with read-ahead (in_flight)")
+    if streaming and catalog_path:
+        raise ValueError("The catalog is loaded from whole sessions in memory; "
+                         "it cannot be filled in streaming mode")
+    if report is None:
+        report = RunReport('RAT SA PROCESSING CODE')
 
-    # -- Folders (adjust as needed) --------------------------------------------
-    base_input_dir = r'C:\Users\oddon\OneDrive\SAD\RATSA RAW'         # Where the raw files are
-    output_directory = r'C:\Users\oddon\OneDrive\SAD\SA Data to process'
-    final_output_dir = r'C:\Users\oddon\OneDrive\SAD\RATSA FINAL'
-    
     # Ensure output directories exist
-    os.makedirs(output_directory, exist_ok=True)
+    if keep_intermediate:
+        os.makedirs(output_directory, exist_ok=True)
+    if events_format:
+        os.makedirs(events_dir, exist_ok=True)
     os.makedirs(final_output_dir, exist_ok=True)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
 
-    # -- Helper function: Convert various file types to TXT -------------------
-    def convert_to_txt(input_file, output_file):
-        try:
-            if input_file.endswith('.csv'):
-                df = pd.read_csv(input_file)
-                df.to_csv(output_file, sep='\t', index=False)
-            elif input_file.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(input_file)
-                df.to_csv(output_file, sep='\t', index=False)
-            elif input_file.endswith('.json'):
-                df = pd.read_json(input_file)
-                df.to_csv(output_file, sep='\t', index=False)
-            else:
-                # Generic text file; just copy contents
-                with open(input_file, 'r', encoding='utf-8', errors='ignore') as file:
-                    content = file.read()
-                with open(output_file, 'w', encoding='utf-8') as out_file:
-                    out_file.write(content)
-            print(f"Data from {input_file} has been successfully written to {output_file}")
-        except Exception as e:
-            print(f"Failed to convert {input_file} to {output_file}. Error: {e}")
-
-    # -- Helper function: Convert only fraction=1 to minutes ------------------
-    def process_time(time_string):
-        """
-        Extracts time value and converts it to minutes if fraction=1.
-        Ignores fraction=2 or fraction=6 (returns None, None).
-        """
-        try:
-            integer_part, fractional_part = time_string.split(".")
-            integer_part = int(integer_part)
-            fractional_part = int(fractional_part) if fractional_part else 0
-            fractional_part = fractional_part // 100  # Keep only first two digits
-
-            # Only process fraction=1; ignore fraction=2 or 6
-            if fractional_part == 1:
-                time_in_minutes = (integer_part * 0.01) / 60.0
-                return time_in_minutes, fractional_part
-            else:
-                return None, None
-        except ValueError:
-            return None, None
-
-    # -- Main loop: Convert and process each file in the input directory -------
-    for file_name in os.listdir(base_input_dir):
-        input_file = os.path.join(base_input_dir, file_name)
+    # -- Main loop: Process the session files in batch mode -------------------
+    # ('workers' processes; log lines come back in listing order and a failing
+    # file does not stop the others)
+    if input_files is None:
+        input_files = [os.path.join(base_input_dir, file_name)
+                       for file_name in os.listdir(base_input_dir)]
+    tasks = []
+    for input_file in input_files:
+        file_name = os.path.basename(input_file)
         
         if not os.path.isfile(input_file):
             print(f"Skipping directory: {file_name}")
+            report.skip(input_file, 'parse', 'directory')
             continue
         
         base_name = os.path.splitext(file_name)[0]
-        output_file_txt = os.path.join(output_directory, base_name + '.txt')
-        
-        # 1) Convert input to TXT (tab-delimited)
-        convert_to_txt(input_file, output_file_txt)
-        
-        # 2) Parse the TXT for up to 16 boxes, but only record fraction=1 events
-        box_data = [{} for _ in range(16)]  # each index -> {time: 1} if fraction=1
-        last_absolute_time = [0.0] * 16
-        
-        current_box_index = -1
-        in_c_section = False
-        
-        with open(output_file_txt, 'r') as f:
-            for line in f:
-                line_stripped = line.strip()
-                
-                # When we see "C:", move to next box
-                if line_stripped.startswith('C:'):
-                    current_box_index += 1
-                    if current_box_index >= 16:
-                        print("Warning: More than 16 boxes detected; ignoring extras.")
-                        break
-                    in_c_section = True
-                    continue
-                
-                # If we are in a "C:" section but reach a blank or new label, exit C-section
-                if in_c_section and (
-                    line_stripped == '' or
-                    line_stripped.startswith(('A:', 'E:', 'F:', 'I:', 'L:', 'R:', 'S:', 'T:', 'V:', 'J:', 'W:'))
-                ):
-                    in_c_section = False
-                    continue
-                
-                # If still in the C-section, parse times (only fraction=1)
-                if in_c_section:
-                    parts = line_stripped.split()
-                    # The first part is typically an index; skip it
-                    numbers = parts[1:]
-                    for num in numbers:
-                        t_minutes, frac = process_time(num)
-                        if t_minutes is not None and frac == 1:
-                            # Accumulate time for the current box
-                            last_absolute_time[current_box_index] += t_minutes
-                            # Store a marker at that absolute time
-                            box_data[current_box_index][last_absolute_time[current_box_index]] = 1
-        
-        # 3) Create a single CSV: "Absolute Time (minutes), Box 1, ..., Box 16"
-        #    Only times for fraction=1 will appear.
-        all_times = sorted(set(t for box in box_data for t in box.keys()))
-        final_headers = ['Absolute Time (minutes)'] + [f'Box {i+1}' for i in range(16)]
-        
-        # Write the aligned data to a CSV
-        aligned_csv_path = os.path.join(output_directory, base_name + '_aligned.csv')
-        with open(aligned_csv_path, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(final_headers)
-            
-            for t in all_times:
-                row = [t]
-                for i in range(16):
-                    # Put a '1' if we have an event, else blank
-                    val = box_data[i].get(t, '')
-                    row.append(val)
-                writer.writerow(row)
-        
-        print(f"Aligned data for fraction=1 (16 boxes) written to {aligned_csv_path}")
-        
-        # 4) (Optional) If you want a final copy in FINALOUTPUT, do so here
-        final_file_path = os.path.join(final_output_dir, base_name + '_final.csv')
-        df_aligned = pd.read_csv(aligned_csv_path)
-        df_aligned.to_csv(final_file_path, index=False)
-        
-        print(f"Final output saved to {final_file_path}")
+        events_path = None
+        if events_format:
+            events_path = os.path.join(events_dir, base_name + '.' + events_format)
+        profile_path = os.path.join(profile_dir, base_name + '.prof') if profile_dir else None
+        tasks.append((input_file, final_output_dir, output_directory, keep_intermediate,
+                      events_path, profile_path, where, streaming, catalog_path))
+
+    with report.stage('files'):
+        if in_flight:
+            outcomes = run_overlapped(process_session_file, tasks, in_flight, max_workers=workers)
+        else:
+            outcomes = run_batch(process_session_file, tasks, max_workers=workers)
+    for task, result, error in outcomes:
+        if error is not None:
+            report.fail(task[0], 'parse', error)
+        else:
+            report.add_file(result[1])
 
 
 # ---------------------------------------------------------------------------
 # Run the function (process all files in the folder).
 # ---------------------------------------------------------------------------
 if __name__ == "__main__":
-    run_raster_plot_parsing()
+    parser = argparse.ArgumentParser(description="Process rat SA session files.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes for the session files (default 1)")
+    parser.add_argument('--keep-intermediate', action='store_true',
+                        help="also write the aligned CSVs to 'SA Data to process'")
+    parser.add_argument('--events-format', choices=['npz', 'parquet', 'feather'],
+                        help="also write each file's events as a typed table to 'RATSA EVENTS'")
+    parser.add_argument('--report', action='append', default=[],
+                        help="save a run report (timings, sizes, failed files) to this "
+                             ".json or .csv path (repeatable)")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="profile the parse of every file with cProfile into DIR and print the top functions")
+    parser.add_argument('--where', type=parse_where,
+                        help="only keep boxes whose header fields match, e.g. 'Subject=R1|R2' or 'Box=1|2|3'")
+    parser.add_argument('--stream', action='store_true',
+                        help="stream each file from disk instead of loading it, so memory stays flat "
+                             "for very long or multi-day sessions (same outputs, no --events-format)")
+    parser.add_argument('--in-flight', type=int, nargs='?', const=DEFAULT_IN_FLIGHT, default=0,
+                        help="read the next files ahead and write outputs in the background, with at "
+                             f"most this many files in flight (default {DEFAULT_IN_FLIGHT} when given); "
+                             "helps on slow synced folders")
+    parser.add_argument('--catalog', metavar='PATH',
+                        help="also load every parsed session into this SQLite session catalog "
+                             "(see sa_catalog.py; keep it on a local disk)")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and process each session file as soon as MED-PC has finished writing it")
+    parser.add_argument('--interval', type=float, default=10,
+                        help="watch mode: seconds between folder checks (default 10)")
+    parser.add_argument('--settle', type=float, default=30,
+                        help="watch mode: seconds a file must stay unchanged to count as finished (default 30)")
+    args = parser.parse_args()
+
+    def run(input_files=None):
+        report = RunReport('RAT SA PROCESSING CODE', {
+            'workers': args.workers, 'keep_intermediate': args.keep_intermediate,
+            'events_format': args.events_format, 'where': args.where, 'stream': args.stream,
+            'in_flight': args.in_flight, 'catalog': args.catalog})
+        run_raster_plot_parsing(keep_intermediate=args.keep_intermediate, workers=args.workers,
+                                events_format=args.events_format, report=report,
+                                profile_dir=args.profile, input_files=input_files,
+                                where=args.where, streaming=args.stream,
+                                in_flight=args.in_flight, catalog_path=args.catalog)
+        print(report.summary())
+        for report_path in args.report:
+            report.save(report_path)
+
+    def is_up_to_date(input_file):
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        final_file_path = os.path.join(final_output_dir, base_name + '_final.csv')
+        return (os.path.isfile(final_file_path) and
+                os.path.getmtime(final_file_path) >= os.path.getmtime(input_file))
+
+    if args.watch:
+        # Watch mode: each finished file is processed on its own, unless its
+        # '_final.csv' is already newer than it (e.g. after a restart).
+        def handle(ready, pending):
+            todo = [f for f in ready if not is_up_to_date(f)]
+            if todo:
+                run(todo)
+        watch_folders([base_input_dir], handle, args.interval, args.settle)
+    else:
+        run()
+    if args.profile:
+        print_profiles([os.path.join(args.profile, f) for f in os.listdir(args.profile)
+                        if f.endswith('.prof')])
@@ -0,0 +1,241 @@
+"""
+Section index for raw MED-PC files.
+
+parse_c_sections walks every line of a file, checking the label tuple on
+each one, just to find the "C:" blocks.  Here the file is memory-mapped and
+one regex scan (in C, over the raw bytes) finds only the lines that matter:
+header fields ('Subject: M1', 'Box: 3', ...) and array labels ('A:', 'C:',
+...).  From those an offset index of sessions and arrays is
+built, and only the requested arrays are decoded - the "C:" arrays by
+default, others on demand.  Sessions can be filtered on their header fields
+before anything is decoded.
+
+A session starts at the first header field that follows an array.  A "C:"
+array ends where parse_c_sections ends it (a blank line, another "C:" or one
+of END_LABELS), so the decoded events are exactly the same; any other array
+ends at the next label or header field.
+"""
+import itertools
+import mmap
+import re
+
+from medpc_parser import END_LABELS, SessionEvents, decode_event
+
+# Label lines.  Matches start at the newline before the line, so the scan
+# jumps from newline to newline at C speed; data lines
+# ('     5:   123.100 ...') fail on their first digit.
+_LABEL = rb'[ \t]*([A-Za-z][A-Za-z ]*?):([^\r\n]*)'
+_LABEL_RE = re.compile(rb'\n' + _LABEL)
+_FIRST_LABEL_RE = re.compile(_LABEL)  # the first line has no newline before it
+# A blank line (the match starts at the newline before it).
+_BLANK_RE = re.compile(rb'\n[ \t]*\r?(?=\n|\Z)')
+_C_ENDS = frozenset(label[:-1] for label in END_LABELS) | {'C'}
+
+
+def parse_where(text):
+    """Parses 'Subject=M1|M2,Box=3' into {'Subject': ['M1', 'M2'], 'Box': ['3']}."""
+    where = {}
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        field, sep, values = part.partition('=')
+        if not sep:
+            raise ValueError(f"Filter '{part}' is not of the form field=value")
+        where[field.strip()] = [v.strip() for v in values.split('|')]
+    return where
+
+
+class Session:
+    """Header fields and array offsets of one session (one box) in a file."""
+
+    def __init__(self, number):
+        self.number = number
+        self.metadata = {}
+        self.arrays = {}   # label -> list of (body start, body end) byte offsets
+        self.c_sections = []  # indices into MedpcIndex.c_sections
+
+    def matches(self, where):
+        """
+        True if the header fields match 'where': a dict of field -> value (or
+        collection of values), compared as text, or a callable taking the
+        metadata dict.
+        """
+        if where is None:
+            return True
+        if callable(where):
+            return bool(where(self.metadata))
+        for field, wanted in where.items():
+            value = self.metadata.get(field)
+            if isinstance(wanted, (list, tuple, set, frozenset)):
+                if value not in {str(w) for w in wanted}:
+                    return False
+            elif value != str(wanted):
+                return False
+        return True
+
+
+class MedpcIndex:
+    """
+    Offset index of one raw MED-PC file.  Use as a context manager (or call
+    close()) so the memory map is released.  'data' indexes text that is
+    already in memory (bytes) instead of mapping 'path'.
+    """
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.sessions = []
+        self.c_sections = []  # (session, body start, body end) in file order
+        self._file = None
+        if data is not None:
+            self._data = data
+        else:
+            self._file = open(path, 'rb')
+            try:
+                self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                self._data = b''
+        self._scan()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- Scan ------------------------------------------------------------------
+    def _scan(self):
+        data = self._data
+        session = None
+        open_arrays = []   # (body list, index) of arrays that end at the next label
+        open_c = None      # the same for the "C:" array still open, plus its c_sections index
+
+        first = _FIRST_LABEL_RE.match(data)
+        for match in itertools.chain([first] if first else [], _LABEL_RE.finditer(data)):
+            line_start = 0 if match is first else match.start() + 1
+            label = match.group(1).decode('ascii')
+
+            if open_c is not None and label in _C_ENDS:
+                self._close_c(open_c, line_start)
+                open_c = None
+            for bodies, i in open_arrays:
+                bodies[i] = (bodies[i][0], line_start)
+            open_arrays = []
+
+            if len(label) > 1:  # header field
+                if session is None or session.arrays:
+                    session = Session(len(self.sessions))
+                    self.sessions.append(session)
+                session.metadata[label.strip()] = match.group(2).decode('utf-8', 'ignore').strip()
+                continue
+
+            if session is None:
+                session = Session(len(self.sessions))
+                self.sessions.append(session)
+            bodies = session.arrays.setdefault(label, [])
+            if label == 'C':
+                # Values on the "C:" line itself are ignored, as in parse_c_sections.
+                bodies.append((self._next_line(match.end()), len(data)))
+                session.c_sections.append(len(self.c_sections))
+                self.c_sections.append((session,) + bodies[-1])
+                open_c = (bodies, len(bodies) - 1, len(self.c_sections) - 1)
+            else:
+                # The value(s) on the label line itself belong to the array.
+                bodies.append((match.start(2), len(data)))
+                open_arrays.append((bodies, len(bodies) - 1))
+
+        if open_c is not None:
+            self._close_c(open_c, len(data))
+
+    def _close_c(self, open_c, end):
+        """Ends an open "C:" array at 'end' or at the first blank line before it."""
+        bodies, i, c_index = open_c
+        start = bodies[i][0]
+        blank = _BLANK_RE.search(self._data, max(start - 1, 0), end)
+        if blank is not None:
+            end = blank.start() + 1
+        bodies[i] = (start, end)
+        self.c_sections[c_index] = (self.c_sections[c_index][0], start, end)
+
+    def _next_line(self, offset):
+        newline = self._data.find(b'\n', offset)
+        return len(self._data) if newline < 0 else newline + 1
+
+    def _lines(self, start, end):
+        # Line breaks as text mode reads them (\r\n, \r or \n).
+        text = self._data[start:end].decode('utf-8', 'ignore')
+        return text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+
+    def iter_lines(self, start, end, block_size=1 << 16):
+        """
+        The lines of [start, end) like _lines, decoded a block at a time (blocks
+        end on a newline), so a long array is never held in memory at once.
+        """
+        data = self._data
+        while start < end:
+            stop = min(start + block_size, end)
+            if stop < end:
+                newline = data.rfind(b'\n', start, stop)
+                if newline < 0:  # a line longer than the block
+                    newline = data.find(b'\n', stop, end)
+                stop = end if newline < 0 else newline + 1
+            text = data[start:stop].decode('utf-8', 'ignore')
+            yield from text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+            start = stop
+
+    # -- Decoding --------------------------------------------------------------
+    def select(self, where=None):
+        """The sessions whose header fields match 'where' (see Session.matches)."""
+        return [s for s in self.sessions if s.matches(where)]
+
+    def array_values(self, session, label):
+        """
+        The values of array 'label' of a session as floats (several arrays
+        with the same label are concatenated).  Scalars like 'A:  0.000' give
+        a one-item list.  The values of "C:" are the raw 'ticks.code' numbers.
+        """
+        values = []
+        for start, end in session.arrays.get(label, []):
+            lines = self._lines(start, end)
+            for n, line in enumerate(lines):
+                parts = line.split()
+                if n > 0 or label == 'C':  # other arrays start on their label line
+                    parts = parts[1:]  # Skip the index
+                for part in parts:
+                    try:
+                        values.append(float(part))
+                    except ValueError:
+                        pass
+        return values
+
+    def parse_c_sections(self, n_boxes=8, fractions=(1, 2, 6), where=None):
+        """
+        Decodes the "C:" arrays like medpc_parser.parse_c_sections: the k-th
+        "C:" array of the file is box k.  Boxes of sessions that do not match
+        'where' stay empty (with no headers) and their arrays are never decoded.
+        """
+        result = SessionEvents(n_boxes)
+        for box_index, (session, start, end) in enumerate(self.c_sections):
+            if box_index >= n_boxes:
+                print(f"Warning: More than {n_boxes} boxes detected, ignoring extras.")
+                break
+            if not session.matches(where):
+                continue
+            result.headers[box_index] = dict(session.metadata)
+            ticks = result.ticks[box_index]
+            codes = result.codes[box_index]
+            last_tick = 0
+            for line in self._lines(start, end):
+                for num in line.split()[1:]:
+                    delta, fractional_part = decode_event(num, fractions)
+                    if delta is not None:
+                        last_tick += delta
+                        ticks.append(last_tick)
+                        codes.append(fractional_part)
+        return result
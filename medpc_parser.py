@@ -0,0 +1,206 @@
+"""
+Single-pass reader for raw MED-PC session files.
+
+The processing scripts used to copy every raw file to a .txt with
+convert_to_txt, re-open that copy to scan its "C:" sections and then write and
+re-read aligned CSVs.  The functions here stream the raw file once and decode
+the C-array times and fraction codes straight into memory.  A .txt copy is only
+written when one is asked for.
+"""
+import io
+from array import array
+
+# Labels that end a "C:" section (a blank line also ends it).
+END_LABELS = ('A:', 'E:', 'F:', 'I:', 'L:', 'R:', 'S:', 'T:', 'V:', 'J:', 'W:')
+
+# Inputs that are read through pandas before being scanned as tab-delimited text.
+TABULAR_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.json')
+
+
+# -- Time decoding -------------------------------------------------------------
+# MED-PC records C-array times as the number of 10 ms ticks since the previous
+# event, with the event code in the fractional digits.
+TICKS_PER_MINUTE = 6000
+
+
+def decode_event(time_string, fractions=(1, 2, 6)):
+    """
+    Splits one C-array value into (ticks since the previous event, fraction
+    code), only keeping the given fractions.  Returns (None, None) for
+    anything else.
+    """
+    try:
+        integer_part, fractional_part = time_string.split(".")
+        integer_part = int(integer_part)
+        fractional_part = int(fractional_part) if fractional_part else 0
+        fractional_part = fractional_part // 100  # Keep only first two digits
+
+        if fractional_part in fractions:
+            return integer_part, fractional_part
+        else:
+            return None, None
+    except ValueError:
+        return None, None
+
+
+def ticks_to_minutes(ticks):
+    """Converts cumulative 10 ms ticks to minutes (only done at output time)."""
+    return ticks / TICKS_PER_MINUTE
+
+
+# -- Reading -------------------------------------------------------------------
+def _tabular_text(input_file):
+    """Renders a .csv/.xlsx/.json input as the tab-delimited text convert_to_txt produced."""
+    import pandas as pd
+
+    if input_file.endswith('.csv'):
+        df = pd.read_csv(input_file)
+    elif input_file.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(input_file)
+    else:
+        df = pd.read_json(input_file)
+    return df.to_csv(sep='\t', index=False)
+
+
+def iter_lines(input_file, txt_copy=None):
+    """
+    Yields the text lines of a session file, reading it exactly once.
+
+    If 'txt_copy' is given, the lines are also written to that path as they are
+    read, giving the same file convert_to_txt used to produce.
+    """
+    if input_file.endswith(TABULAR_EXTENSIONS):
+        source = io.StringIO(_tabular_text(input_file))
+    else:
+        source = open(input_file, 'r', encoding='utf-8', errors='ignore')
+
+    with source:
+        if txt_copy is None:
+            yield from source
+            return
+        with open(txt_copy, 'w', encoding='utf-8') as out_file:
+            for line in source:
+                out_file.write(line)
+                yield line
+        print(f"Data from {input_file} has been successfully written to {txt_copy}")
+
+
+# -- Event store ---------------------------------------------------------------
+class SessionEvents:
+    """
+    Decoded "C:" events of one file, kept as compact per-box arrays: the
+    cumulative time of each event in integer 10 ms ticks ('q') and its
+    fraction code ('b').  Integer ticks keep times that should line up across
+    boxes exactly equal, with no float error building up over a session.
+
+    'headers' has the header fields of each box's session ('Subject', 'Box',
+    'Start Date', ...) when the file was read through medpc_index, else None.
+    """
+
+    def __init__(self, n_boxes):
+        self.ticks = [array('q') for _ in range(n_boxes)]
+        self.codes = [array('b') for _ in range(n_boxes)]
+        self.headers = [None] * n_boxes
+
+    @classmethod
+    def combine(cls, *sessions):
+        """Stacks sessions box-wise, e.g. the 1-8 and 9-16 halves into 16 boxes."""
+        combined = cls(0)
+        for session in sessions:
+            combined.ticks.extend(session.ticks)
+            combined.codes.extend(session.codes)
+            combined.headers.extend(session.headers)
+        return combined
+
+    @property
+    def n_boxes(self):
+        return len(self.ticks)
+
+    def n_events(self):
+        return sum(len(t) for t in self.ticks)
+
+    def box_lookup(self, box_index):
+        """{tick: code} for one box; a later event at the same tick wins."""
+        return dict(zip(self.ticks[box_index], self.codes[box_index]))
+
+    def align(self):
+        """
+        Aligns all boxes on one time axis.  Returns (all_ticks, columns): the
+        sorted distinct ticks across boxes and, per box, a list with the code
+        at each of those ticks (None where the box has no event).
+        """
+        lookups = [self.box_lookup(i) for i in range(self.n_boxes)]
+        all_ticks = sorted(set().union(*lookups))
+        columns = [[lookup.get(t) for t in all_ticks] for lookup in lookups]
+        return all_ticks, columns
+
+
+# -- Parsing -------------------------------------------------------------------
+def parse_c_sections(lines, n_boxes=8, fractions=(1, 2, 6)):
+    """
+    Decodes the "C:" sections of a MED-PC file.  Each "C:" label starts the next
+    box; a blank line or another array label ends the section.
+
+    Returns a SessionEvents with 'n_boxes' boxes, times accumulated over the
+    kept fractions only.
+    """
+    session = SessionEvents(n_boxes)
+    in_c_section = False
+    current_box_index = -1  # will increment when a line starts with "C:"
+
+    for line in lines:
+        line_stripped = line.strip()
+
+        if line_stripped.startswith('C:'):
+            current_box_index += 1
+            if current_box_index >= n_boxes:
+                print(f"Warning: More than {n_boxes} boxes detected, ignoring extras.")
+                break
+            in_c_section = True
+            ticks = session.ticks[current_box_index]
+            codes = session.codes[current_box_index]
+            last_tick = 0  # Track cumulative time of the box
+            continue
+
+        if in_c_section:
+            if line_stripped == '' or line_stripped.startswith(END_LABELS):
+                in_c_section = False
+                continue
+
+            numbers = line_stripped.split()[1:]  # Skip the index
+            for num in numbers:
+                delta, fractional_part = decode_event(num, fractions)
+                if delta is not None:
+                    last_tick += delta
+                    ticks.append(last_tick)
+                    codes.append(fractional_part)
+
+    return session
+
+
+def parse_medpc_file(input_file, n_boxes=8, fractions=(1, 2, 6), txt_copy=None, where=None,
+                     data=None):
+    """
+    Reads a raw MED-PC file and returns its decoded "C:" events as a
+    SessionEvents (see parse_c_sections).  The file is memory-mapped and only
+    its "C:" arrays are decoded (see medpc_index); 'where' (e.g.
+    {'Subject': 'M3'} or {'Box': [1, 2]}) leaves the boxes of sessions whose
+    header fields do not match empty without decoding them.
+
+    No intermediate .txt is written unless 'txt_copy' names one.  'data' is
+    the raw file's content if it was already read (see sa_io.prefetched).
+    """
+    # Imported here: medpc_index builds on the event store above.
+    from medpc_index import MedpcIndex
+
+    if txt_copy is not None:
+        data = None
+        # The copy has the text the scripts used to parse; index that.
+        for _ in iter_lines(input_file, txt_copy):
+            pass
+        input_file = txt_copy
+    elif input_file.endswith(TABULAR_EXTENSIONS):
+        data = _tabular_text(input_file).encode('utf-8')
+
+    with MedpcIndex(input_file, data) as index:
+        return index.parse_c_sections(n_boxes, fractions, where)
@@ -0,0 +1,167 @@
+"""
+Bounded-memory streaming of raw MED-PC files.
+
+parse_medpc_file decodes every event of every box into memory and align()
+then builds the sorted set of all times, so memory grows with the length of
+the session and the sort runs at the end.  Here each box's "C:" array is
+decoded lazily, line by line from the memory-mapped file, into a stream of
+cumulative ticks, and the per-box streams are merged in time order with a
+heap holding one entry per box:
+
+    with AlignedStream(input_file, n_boxes=8, fractions=(1, 2, 6)) as stream:
+        for tick, codes, deltas in stream.rows():
+            ...
+
+Each row is one distinct tick with, per box, the event code at that tick (or
+None) and the ticks since the box's previous event - the same rows, in the
+same order, as session.align() gives, so tables written from them are
+byte-identical.  Memory stays flat however long the session is.
+write_tables() writes the tables of a file from one pass over its rows, in
+chunks of CHUNK_ROWS.
+"""
+import contextlib
+import csv
+import heapq
+from itertools import islice
+
+from medpc_parser import TABULAR_EXTENSIONS, _tabular_text, decode_event
+from sa_io import atomic_path
+
+CHUNK_ROWS = 4096
+
+
+class AlignedStream:
+    """
+    The aligned rows of one raw file, streamed.  Use as a context manager so
+    the memory map is released.  'where' leaves the boxes of sessions whose
+    header fields do not match empty, as in parse_medpc_file.
+    """
+
+    def __init__(self, input_file, n_boxes=8, fractions=(1, 2, 6), where=None):
+        # Imported here, like in parse_medpc_file.
+        from medpc_index import MedpcIndex
+
+        data = None
+        if input_file.endswith(TABULAR_EXTENSIONS):
+            data = _tabular_text(input_file).encode('utf-8')
+        self.index = MedpcIndex(input_file, data)
+        self.n_boxes = n_boxes
+        self.fractions = fractions
+        self.sections = [None] * n_boxes  # (start, end) of each box's "C:" array
+        for box_index, (session, start, end) in enumerate(self.index.c_sections):
+            if box_index >= n_boxes:
+                print(f"Warning: More than {n_boxes} boxes detected, ignoring extras.")
+                break
+            if session.matches(where):
+                self.sections[box_index] = (start, end)
+        self.events_per_box = [0] * n_boxes  # decoded events, filled in as rows are read
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _box_events(self, box_index):
+        """
+        Yields (tick, code, delta) of one box, one item per distinct tick: as
+        in SessionEvents.box_lookup, a later event at the same tick wins.
+        """
+        start, end = self.sections[box_index]
+        count = 0
+        last_tick = 0
+        pending = None
+        for line in self.index.iter_lines(start, end):
+            for num in line.split()[1:]:
+                delta, code = decode_event(num, self.fractions)
+                if delta is None:
+                    continue
+                tick = last_tick + delta
+                count += 1
+                if pending is not None:
+                    if tick < pending[0]:
+                        raise ValueError(f"Box {box_index + 1}: event times go backwards, "
+                                         f"cannot be streamed")
+                    if tick != pending[0]:
+                        yield pending
+                pending = (tick, code, delta)
+                last_tick = tick
+        self.events_per_box[box_index] = count
+        if pending is not None:
+            yield pending
+
+    def rows(self):
+        """
+        Yields (tick, codes, deltas) per distinct tick in time order; 'codes'
+        and 'deltas' have one item per box, None where the box has no event.
+        Can be called again to read the file again.
+        """
+        streams = [self._box_events(i) if self.sections[i] else iter(())
+                   for i in range(self.n_boxes)]
+        heap = []
+        for i, stream in enumerate(streams):
+            first = next(stream, None)
+            if first is not None:
+                heap.append((first[0], i, first[1], first[2]))
+        heapq.heapify(heap)
+
+        while heap:
+            tick = heap[0][0]
+            codes = [None] * self.n_boxes
+            deltas = [None] * self.n_boxes
+            while heap and heap[0][0] == tick:
+                _, i, code, delta = heap[0]
+                codes[i] = code
+                deltas[i] = delta
+                following = next(streams[i], None)
+                if following is None:
+                    heapq.heappop(heap)
+                else:
+                    heapq.heapreplace(heap, (following[0], i, following[1], following[2]))
+            yield tick, codes, deltas
+
+    def always(self, columns):
+        """
+        For each (box index, codes) in 'columns': True if that box has one of
+        'codes' at every row.  Reads only as far as needed to rule every
+        column out (usually a few rows).
+        """
+        result = [True] * len(columns)
+        undecided = set(range(len(columns)))
+        for _, codes, _ in self.rows():
+            for j in list(undecided):
+                box_index, accepted = columns[j]
+                if codes[box_index] not in accepted:
+                    result[j] = False
+                    undecided.discard(j)
+            if not undecided:
+                break
+        return result
+
+
+def write_tables(rows, tables, chunk_rows=CHUNK_ROWS):
+    """
+    Writes several CSV tables in one pass over 'rows' (from
+    AlignedStream.rows).  'tables' is a list of (path, headers, make_row),
+    make_row(tick, codes, deltas) giving the table's row; rows are written
+    in chunks of 'chunk_rows'.  Each table is written under a temporary name
+    and renamed into place once every row is written (see sa_io).
+    """
+    with contextlib.ExitStack() as files:
+        writers = []
+        for path, headers, _ in tables:
+            temp_path = files.enter_context(atomic_path(path))
+            writer = csv.writer(files.enter_context(open(temp_path, 'w', newline='')))
+            writer.writerow(headers)
+            writers.append(writer)
+        makers = [make_row for _, _, make_row in tables]
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                break
+            for writer, make_row in zip(writers, makers):
+                writer.writerows([make_row(tick, codes, deltas) for tick, codes, deltas in chunk])
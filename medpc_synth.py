@@ -0,0 +1,136 @@
+"""
+Synthetic MED-PC session files for benchmarking.
+
+Writes raw files laid out like the ones the rigs export: one block per box
+with the usual header lines, scalar arrays and a "C:" array of
+"ticks.code00" values, five per line.  Event times are random (exponential
+gaps at a given rate per box); the fraction code of each event is drawn from
+a weighted mix, e.g. {1: 0.7, 2: 0.1, 6: 0.1, 3: 0.1} for mostly active
+responses with a few codes the scripts ignore.
+
+A cohort of 16 boxes is written the way the mouse script expects it: boxes
+1-8 in 'files' and boxes 9-16 in 'files9-16', under the same file names.
+
+    python medpc_synth.py C:\\temp\\synthetic --boxes 16 --files 20 --minutes 180 --rate 2
+"""
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from medpc_parser import TICKS_PER_MINUTE
+
+DEFAULT_MIX = {1: 0.7, 2: 0.1, 6: 0.1, 3: 0.1}
+
+
+def parse_mix(text):
+    """Parses '1:0.7,2:0.1,6:0.2' into {1: 0.7, 2: 0.1, 6: 0.2}."""
+    mix = {}
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        code, sep, weight = part.partition(':')
+        if not sep:
+            raise ValueError(f"Mix entry '{part}' is not of the form code:weight")
+        mix[int(code)] = float(weight)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("The fraction-code mix needs at least one positive weight")
+    return mix
+
+
+def box_events(rng, minutes, rate, mix):
+    """
+    Random C-array values for one box: 'rate' events per minute on average
+    over 'minutes', each as 'delta_ticks.code00'.
+    """
+    codes = list(mix)
+    weights = [mix[c] for c in codes]
+    session_ticks = int(minutes * TICKS_PER_MINUTE)
+    mean_gap = TICKS_PER_MINUTE / rate if rate > 0 else None
+
+    values = []
+    elapsed = 0
+    while mean_gap is not None:
+        gap = int(rng.expovariate(1.0 / mean_gap))
+        elapsed += gap
+        if elapsed > session_ticks:
+            break
+        code = rng.choices(codes, weights)[0]
+        values.append(f"{gap}.{code * 100:03d}")
+    return values
+
+
+def session_text(rng, first_box, n_boxes, minutes, rate, mix, start_date, subject_prefix='M'):
+    """The text of one raw file with boxes first_box .. first_box + n_boxes - 1."""
+    end_minutes = int(minutes)
+    lines = []
+    for box in range(first_box, first_box + n_boxes):
+        # Boxes run a little faster or slower than the cohort average.
+        box_rate = rate * rng.uniform(0.5, 1.5)
+        values = box_events(rng, minutes, box_rate, mix)
+        lines += [
+            "",
+            f"Start Date: {start_date:%m/%d/%y}",
+            f"End Date: {start_date:%m/%d/%y}",
+            f"Subject: {subject_prefix}{box:02d}",
+            "Experiment: SA",
+            "Group: 1",
+            f"Box: {box}",
+            "Start Time: 9:00:00",
+            f"End Time: {9 + end_minutes // 60}:{end_minutes % 60:02d}:00",
+            "MSN: SA_FR1",
+            "A:       0.000",
+            "B:       0.000",
+            "C:",
+        ]
+        for i in range(0, len(values), 5):
+            lines.append(f"{i:6d}:" + "".join(f"{v:>13}" for v in values[i:i + 5]))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def write_cohort(root, n_files=10, boxes=16, minutes=180, rate=2.0, mix=None, seed=0):
+    """
+    Writes 'n_files' sessions under 'root' ('files' and, for 16 boxes,
+    'files9-16').  Returns the list of (input_directory, suffix) halves, in the
+    form sa_pipeline.run_mouse_pipeline takes.
+    """
+    if boxes not in (8, 16):
+        raise ValueError("boxes must be 8 or 16")
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    halves = [(os.path.join(root, 'files'), '')]
+    if boxes == 16:
+        halves.append((os.path.join(root, 'files9-16'), '_9-16'))
+    for directory, _ in halves:
+        os.makedirs(directory, exist_ok=True)
+
+    first_day = date(2024, 1, 1)
+    for n in range(n_files):
+        day = first_day + timedelta(days=n)
+        file_name = f"{day:%Y-%m-%d}_SA_{n:03d}.txt"
+        for half, (directory, _) in enumerate(halves):
+            text = session_text(rng, 1 + 8 * half, 8, minutes, rate, mix, day)
+            with open(os.path.join(directory, file_name), 'w', newline='\r\n') as f:
+                f.write(text)
+    return halves
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic cohort of MED-PC session files.")
+    parser.add_argument('root', help="folder to write 'files' (and 'files9-16') into")
+    parser.add_argument('--boxes', type=int, choices=[8, 16], default=16)
+    parser.add_argument('--files', type=int, default=10, help="sessions in the cohort (default 10)")
+    parser.add_argument('--minutes', type=float, default=180, help="session length (default 180)")
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help="average events per minute per box (default 2)")
+    parser.add_argument('--mix', default='1:0.7,2:0.1,6:0.1,3:0.1',
+                        help="fraction-code weights (default '1:0.7,2:0.1,6:0.1,3:0.1')")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    halves = write_cohort(args.root, args.files, args.boxes, args.minutes, args.rate,
+                          parse_mix(args.mix), args.seed)
+    for directory, _ in halves:
+        print(f"Wrote {args.files} sessions to {directory}")
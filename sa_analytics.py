@@ -0,0 +1,312 @@
+"""
+Behavioural metrics for whole cohorts, computed with array operations.
+
+The counting script only counts responses per box.  Here the per-box
+response times of every session are put end to end in one sorted array
+(with the box each event belongs to), and every metric is computed for all
+boxes and sessions at once with NumPy - no loop over rows:
+
+    iri_summary        inter-response intervals: n, mean, SD, CV, median, percentiles
+    iri_histogram      IRI distribution per box on shared (log-spaced) bins
+    bursts             runs of responses separated by at most 'gap' minutes
+    box_summary        responses, time to first response, bursts and the
+                       loading phase (the first burst, if it starts early)
+    cumulative_curves  cumulative responses per box on a common time grid
+
+Every function returns a tidy table: a dict of equal-length columns, one row
+per box (or burst, bin, ...) with 'session' and 'box' columns, which
+write_table() saves as CSV and pandas.DataFrame() takes as is.
+
+    python sa_analytics.py C:\\...\\EVENTS --out C:\\...\\ANALYTICS --end-time 180
+
+Inputs are read like sa_plots reads them: raw MED-PC files, EVENTS files or
+the scripts' CSVs.  Times are in minutes, intervals in seconds.
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from sa_io import atomic_path
+from sa_plots import input_files, load_times, parse_codes
+
+DEFAULT_IRI_EDGES = np.concatenate(([0.0], np.geomspace(1, 3600, 25), [np.inf]))  # seconds
+PERCENTILES = (10, 25, 75, 90)
+
+
+# -- Cohort --------------------------------------------------------------------
+class Cohort:
+    """
+    The responses of many boxes as flat arrays: 'time' (minutes, sorted
+    within each box) and 'group' (index of the box in 'sessions'/'boxes'),
+    sorted by group.
+    """
+
+    def __init__(self, sessions, boxes, group, time):
+        self.sessions = list(sessions)  # session name of each group
+        self.boxes = list(boxes)        # box label of each group
+        self.group = np.asarray(group, dtype=np.int64)
+        self.time = np.asarray(time, dtype=float)
+
+    @classmethod
+    def from_times(cls, named_times):
+        """Builds a Cohort from (session name, labels, per-box times) items."""
+        sessions, boxes, groups, times = [], [], [], []
+        for name, labels, box_times in named_times:
+            for label, t in zip(labels, box_times):
+                t = np.sort(np.asarray(t, dtype=float))
+                groups.append(np.full(len(t), len(boxes), dtype=np.int64))
+                times.append(t)
+                sessions.append(name)
+                boxes.append(label)
+        if not groups:
+            return cls([], [], [], [])
+        return cls(sessions, boxes, np.concatenate(groups), np.concatenate(times))
+
+    @classmethod
+    def from_files(cls, paths, n_boxes=8, fractions=(1, 2, 6), marks=(1, 2)):
+        """Reads every session file under 'paths' (folders are expanded)."""
+        def named():
+            for path in input_files(paths):
+                labels, times = load_times(path, n_boxes, fractions, marks)
+                yield os.path.splitext(os.path.basename(path))[0], labels, times
+        return cls.from_times(named())
+
+    @property
+    def n_groups(self):
+        return len(self.boxes)
+
+    def window(self, start_time=0, end_time=None):
+        """The responses in [start_time, end_time] (every box is kept)."""
+        keep = self.time >= start_time
+        if end_time is not None:
+            keep &= self.time <= end_time
+        return Cohort(self.sessions, self.boxes, self.group[keep], self.time[keep])
+
+    def counts(self):
+        return np.bincount(self.group, minlength=self.n_groups)
+
+    def first_index(self):
+        """Index of each group's first response (valid where counts() > 0)."""
+        return np.searchsorted(self.group, np.arange(self.n_groups))
+
+    def key_columns(self, groups=None):
+        """The 'session' and 'box' columns for rows of the given groups (all by default)."""
+        sessions = np.asarray(self.sessions, dtype=object)
+        boxes = np.asarray(self.boxes, dtype=object)
+        if groups is None:
+            return {'session': sessions, 'box': boxes}
+        return {'session': sessions[groups], 'box': boxes[groups]}
+
+
+# -- Inter-response intervals --------------------------------------------------
+def inter_response_intervals(cohort):
+    """(intervals in seconds, group of each interval) between consecutive responses of a box."""
+    same_box = cohort.group[1:] == cohort.group[:-1]
+    intervals = np.diff(cohort.time)[same_box] * 60.0
+    return intervals, cohort.group[1:][same_box]
+
+
+def _group_quantiles(values, groups, n_groups, quantiles):
+    """Linear-interpolated quantiles of 'values' per group (NaN for empty groups)."""
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = {}
+    for q in quantiles:
+        position = offsets + q * np.maximum(counts - 1, 0)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, offsets + counts - 1)
+        if len(values):
+            low_values = values[np.minimum(low, len(values) - 1)]
+            high_values = values[np.clip(high, 0, len(values) - 1)]
+            quantile = low_values + (position - low) * (high_values - low_values)
+        else:
+            quantile = np.zeros(n_groups)
+        result[q] = np.where(counts > 0, quantile, np.nan)
+    return result
+
+
+def iri_summary(cohort, percentiles=PERCENTILES):
+    """Per box: number of intervals, mean, SD, CV, median and percentiles (seconds)."""
+    intervals, groups = inter_response_intervals(cohort)
+    n = np.bincount(groups, minlength=cohort.n_groups)
+    total = np.bincount(groups, weights=intervals, minlength=cohort.n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, total / n, np.nan)
+        squares = np.bincount(groups, weights=(intervals - mean[groups]) ** 2,
+                              minlength=cohort.n_groups)
+        sd = np.where(n > 1, np.sqrt(squares / (n - 1)), np.nan)
+        cv = sd / mean
+    quantiles = _group_quantiles(intervals, groups, cohort.n_groups,
+                                 [0.5] + [p / 100 for p in percentiles])
+    table = cohort.key_columns()
+    table.update({'intervals': n, 'iri_mean_s': mean, 'iri_sd_s': sd, 'iri_cv': cv,
+                  'iri_median_s': quantiles[0.5]})
+    for p in percentiles:
+        table[f'iri_p{p}_s'] = quantiles[p / 100]
+    return table
+
+
+def iri_histogram(cohort, edges=DEFAULT_IRI_EDGES):
+    """Per box and bin: the number of intervals (seconds) in [bin_start, bin_end)."""
+    edges = np.asarray(edges, dtype=float)
+    n_bins = len(edges) - 1
+    intervals, groups = inter_response_intervals(cohort)
+    bins = np.clip(np.searchsorted(edges, intervals, side='right') - 1, 0, n_bins - 1)
+    counts = np.bincount(groups * n_bins + bins, minlength=cohort.n_groups * n_bins)
+    table = cohort.key_columns(np.repeat(np.arange(cohort.n_groups), n_bins))
+    table.update({'bin_start_s': np.tile(edges[:-1], cohort.n_groups),
+                  'bin_end_s': np.tile(edges[1:], cohort.n_groups),
+                  'intervals': counts})
+    return table
+
+
+# -- Bursts --------------------------------------------------------------------
+def _bursts(cohort, gap, min_responses):
+    """Index arrays (first response, responses, group) of the bursts with enough responses."""
+    if not len(cohort.time):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    starts_new = np.concatenate(([True], (cohort.group[1:] != cohort.group[:-1]) |
+                                 (np.diff(cohort.time) > gap)))
+    first = np.flatnonzero(starts_new)
+    sizes = np.diff(np.append(first, len(cohort.time)))
+    keep = sizes >= min_responses
+    return first[keep], sizes[keep], cohort.group[first[keep]]
+
+
+def bursts(cohort, gap=1.0, min_responses=3):
+    """
+    One row per burst: a run of at least 'min_responses' responses of a box
+    with no interval longer than 'gap' minutes.  'burst' numbers the bursts
+    of each box from 1.
+    """
+    first, sizes, groups = _bursts(cohort, gap, min_responses)
+    start = cohort.time[first]
+    end = cohort.time[first + sizes - 1]
+    duration = end - start
+    table = cohort.key_columns(groups)
+    table.update({
+        'burst': np.arange(len(groups)) - np.searchsorted(groups, groups) + 1,
+        'start_min': start, 'end_min': end, 'duration_min': duration, 'responses': sizes,
+        'rate_per_min': np.divide(sizes - 1, duration, out=np.full(len(sizes), np.nan),
+                                  where=duration > 0),
+    })
+    return table
+
+
+def box_summary(cohort, start_time=0, gap=1.0, min_responses=3, loading_within=10.0):
+    """
+    One row per box: responses, time to first response (minutes from
+    'start_time', NaN without responses), bursts, the share of responses in
+    bursts, and the loading phase - the first burst if it starts within
+    'loading_within' minutes of 'start_time'.
+    """
+    n = cohort.n_groups
+    counts = cohort.counts()
+    has_responses = counts > 0
+    first_response = np.full(n, np.nan)
+    first_response[has_responses] = cohort.time[cohort.first_index()[has_responses]] - start_time
+
+    first, sizes, groups = _bursts(cohort, gap, min_responses)
+    n_bursts = np.bincount(groups, minlength=n)
+    in_bursts = np.bincount(groups, weights=sizes, minlength=n)
+
+    # The loading phase: each box's first burst, if it starts early enough.
+    first_burst = np.searchsorted(groups, np.arange(n))[n_bursts > 0]
+    burst_start = cohort.time[first[first_burst]] - start_time
+    loading = np.flatnonzero(n_bursts > 0)[burst_start <= loading_within]
+    first_burst = first_burst[burst_start <= loading_within]
+    loading_responses = np.zeros(n, dtype=np.int64)
+    loading_responses[loading] = sizes[first_burst]
+    loading_end = np.full(n, np.nan)
+    loading_end[loading] = cohort.time[first[first_burst] + sizes[first_burst] - 1] - start_time
+
+    table = cohort.key_columns()
+    table.update({
+        'responses': counts,
+        'first_response_min': first_response,
+        'bursts': n_bursts,
+        'burst_fraction': np.divide(in_bursts, counts, out=np.full(n, np.nan), where=has_responses),
+        'loading_responses': loading_responses,
+        'loading_end_min': loading_end,
+    })
+    return table
+
+
+# -- Cumulative records --------------------------------------------------------
+def cumulative_curves(cohort, bin_width=1.0, start_time=0, end_time=None):
+    """
+    Per box and time point: cumulative responses up to 'time_min', on a grid
+    of 'bin_width' minutes from start_time to end_time (the last response by
+    default).
+    """
+    if end_time is None:
+        end_time = float(cohort.time.max()) if len(cohort.time) else start_time + bin_width
+    n_bins = max(int(np.ceil((end_time - start_time) / bin_width)), 1)
+    cohort = cohort.window(start_time, end_time)
+    bins = np.minimum(((cohort.time - start_time) // bin_width).astype(np.int64), n_bins - 1)
+    counts = np.bincount(cohort.group * n_bins + bins, minlength=cohort.n_groups * n_bins)
+    cumulative = np.cumsum(counts.reshape(cohort.n_groups, n_bins), axis=1)
+    grid = np.minimum(start_time + bin_width * np.arange(1, n_bins + 1), end_time)
+    table = cohort.key_columns(np.repeat(np.arange(cohort.n_groups), n_bins))
+    table.update({'time_min': np.tile(grid, cohort.n_groups), 'responses': cumulative.ravel()})
+    return table
+
+
+# -- Output --------------------------------------------------------------------
+def write_table(path, table):
+    """Writes a tidy table (dict of columns) as CSV, renamed into place once complete."""
+    with atomic_path(path) as temp_path:
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(list(table))
+            writer.writerows(zip(*[np.asarray(c).tolist() for c in table.values()]))
+
+
+def analyze(cohort, start_time=0, end_time=None, gap=1.0, min_responses=3,
+            loading_within=10.0, bin_width=1.0):
+    """Every table for the responses in [start_time, end_time], by file name."""
+    cohort = cohort.window(start_time, end_time)
+    return {
+        'Box_Summary.csv': box_summary(cohort, start_time, gap, min_responses, loading_within),
+        'IRI_Summary.csv': iri_summary(cohort),
+        'IRI_Histogram.csv': iri_histogram(cohort),
+        'Bursts.csv': bursts(cohort, gap, min_responses),
+        'Cumulative.csv': cumulative_curves(cohort, bin_width, start_time, end_time),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute IRI, burst, latency and cumulative-record tables.")
+    parser.add_argument('inputs', nargs='+',
+                        help="session files or folders: raw MED-PC files, EVENTS files or the scripts' CSVs")
+    parser.add_argument('--out', required=True, help="folder for the CSV tables")
+    parser.add_argument('--start-time', type=float, default=0, help="minutes (default 0)")
+    parser.add_argument('--end-time', type=float, help="minutes (default: the last response)")
+    parser.add_argument('--gap', type=float, default=1.0,
+                        help="longest interval within a burst, in minutes (default 1)")
+    parser.add_argument('--min-burst', type=int, default=3,
+                        help="fewest responses that make a burst (default 3)")
+    parser.add_argument('--loading-within', type=float, default=10.0,
+                        help="a first burst starting within this many minutes is the loading phase (default 10)")
+    parser.add_argument('--bin-width', type=float, default=1.0,
+                        help="time step of the cumulative records, in minutes (default 1)")
+    parser.add_argument('--boxes', type=int, default=8,
+                        help="raw files: boxes per file (default 8, 16 for the rat files)")
+    parser.add_argument('--fractions', type=parse_codes, default=(1, 2, 6),
+                        help="raw files: fraction codes to decode (default 1,2,6; 1 for the rat files)")
+    parser.add_argument('--marks', type=parse_codes, default=(1, 2),
+                        help="raw/EVENTS files: codes counted as responses (default 1,2)")
+    args = parser.parse_args()
+
+    cohort = Cohort.from_files(args.inputs, args.boxes, args.fractions, args.marks)
+    os.makedirs(args.out, exist_ok=True)
+    tables = analyze(cohort, args.start_time, args.end_time, args.gap, args.min_burst,
+                     args.loading_within, args.bin_width)
+    for file_name, table in tables.items():
+        write_table(os.path.join(args.out, file_name), table)
+    print(f"Wrote {len(tables)} tables for {cohort.n_groups} boxes to {args.out}")
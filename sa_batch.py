@@ -0,0 +1,71 @@
+"""
+Batch mode for the processing scripts: runs one worker call per session file
+on a process pool.
+
+Every session file is independent, so files are spread across
+'max_workers' processes.  Whatever a worker prints is captured in the worker
+and replayed in the parent in submission order, so the log reads the same as
+a serial run.  An exception in one file is reported and the other files
+carry on.
+"""
+import contextlib
+import io
+import os
+
+
+def default_workers():
+    """One worker per core."""
+    return os.cpu_count() or 1
+
+
+def _run_captured(worker, args):
+    """Runs worker(*args) in a pool process, returning (result, error, log)."""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            return worker(*args), None, log.getvalue()
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}", log.getvalue()
+
+
+def run_batch(worker, tasks, max_workers=1):
+    """
+    Calls worker(*task) for every task and returns a list of
+    (task, result, error) in the order the tasks were given.  'error' is None
+    on success, otherwise a short description and 'result' is None.  The
+    first item of each task (the input file) names it in failure messages.
+
+    With max_workers=1 everything runs in this process; otherwise a process
+    pool of that size is used ('worker' must then be importable/picklable).
+    """
+    tasks = list(tasks)
+    outcomes = []
+
+    if max_workers is None:
+        max_workers = default_workers()
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            try:
+                outcomes.append((task, worker(*task), None))
+            except Exception as e:
+                outcomes.append((task, None, f"{type(e).__name__}: {e}"))
+                print(f"Failed to process {task[0]}. Error: {outcomes[-1][2]}")
+        return outcomes
+
+    from concurrent.futures import ProcessPoolExecutor  # only needed with workers
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+        futures = [pool.submit(_run_captured, worker, task) for task in tasks]
+        # Replay results strictly in submission order for a stable log.
+        for task, future in zip(tasks, futures):
+            try:
+                result, error, log = future.result()
+            except Exception as e:  # the worker process itself died
+                result, error, log = None, f"{type(e).__name__}: {e}", ''
+            if log:
+                print(log, end='')
+            if error is not None:
+                print(f"Failed to process {task[0]}. Error: {error}")
+            outcomes.append((task, result, error))
+    return outcomes
@@ -0,0 +1,397 @@
+"""
+Benchmark harness for the SA processing code.
+
+Generates a synthetic cohort (see medpc_synth) or takes an existing folder
+with 'files' and 'files9-16', then times each stage of the mouse workflow
+over every session:
+
+    parse     raw file -> decoded events
+    align     events of all boxes on one time axis
+    raster    raster-ready table (Fraction and Box n-1/2/6 columns), rendered as CSV
+    final     column selection down to the Box n-1 series, rendered as CSV
+    bridge    merge of the 1-8 and 9-16 halves over [start, end], rendered as CSV
+    count     per-box counts in [start, end] plus fixed-width bins
+    pipeline  the whole run_mouse_pipeline, files written to disk
+
+Each stage reports seconds (best of --repeat), events per second and the
+peak memory it allocated (tracemalloc, measured in a separate pass so it
+does not slow the timings down).
+
+The pipeline's files are then checked against a plain port of the original
+run_raster_plot_parsing / counting code: same raster-ready, FINALOUTPUT,
+bridged and Final_Counts contents, cell for cell.  The port keys times on the
+10 ms tick instead of summing float minutes; that is the one intended
+difference from the original scripts.
+
+    python sa_benchmark.py --files 20 --rate 3
+    python sa_benchmark.py --input C:\\Users\\oddon\\OneDrive\\SAD --files 0
+
+--startup times how long each script takes to start instead (a fresh
+interpreter running 'script --help': the imports plus argument parsing),
+against a bare interpreter, and lists the heavy libraries it imported.  The
+processing and counting scripts should not load any of them.
+
+    python sa_benchmark.py --startup
+"""
+import argparse
+import contextlib
+import csv
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from medpc_parser import END_LABELS, TICKS_PER_MINUTE, decode_event, parse_medpc_file
+from medpc_synth import parse_mix, write_cohort
+from sa_bridge import events_stream, merge_streams
+from sa_counts import binned_counts, box_times_from_streams, make_bins
+from sa_pipeline import mouse_final_rows, mouse_raster_rows, run_mouse_pipeline
+
+STAGES = ('parse', 'align', 'raster', 'final', 'bridge', 'count', 'pipeline')
+STARTUP_SCRIPTS = ('MOUSE SA PROCESSING CODE.py', 'MOUSE SA COUNTING CODE.py',
+                   'RAT SA PROCESSING CODE.py', 'sa_plots.py', 'sa_analytics.py')
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'openpyxl', 'matplotlib')
+
+
+# -- Reference (the original algorithm) ----------------------------------------
+def reference_parse(input_file):
+    """The original C-section loop: one {tick: fraction} dict per box."""
+    box_data = [{} for _ in range(8)]
+    with open(input_file, 'r', encoding='utf-8', errors='ignore') as file:
+        in_c_section = False
+        current_box_index = -1
+        last_absolute_time = [0] * 8
+        for line in file:
+            if line.strip().startswith('C:'):
+                current_box_index += 1
+                if current_box_index >= 8:
+                    break
+                in_c_section = True
+                continue
+            if in_c_section:
+                if line.strip() == '' or line.strip().startswith(END_LABELS):
+                    in_c_section = False
+                    continue
+                for num in line.strip().split()[1:]:
+                    delta, fractional_part = decode_event(num)
+                    if delta is not None:
+                        last_absolute_time[current_box_index] += delta
+                        box_data[current_box_index][last_absolute_time[current_box_index]] = fractional_part
+    return box_data
+
+
+def _pandas_column(values):
+    """
+    Renders a numeric column the way read_csv/to_csv round-tripped it: float
+    ('1.0') if any cell is blank, int ('1') otherwise.
+    """
+    as_float = any(v is None for v in values)
+    return ['' if v is None else str(float(v) if as_float else int(v)) for v in values]
+
+
+def reference_tables(box_data):
+    """The raster-ready and FINALOUTPUT tables of the original, as rows of strings."""
+    all_ticks = sorted(set(t for box in box_data for t in box))
+    times = [str(t / TICKS_PER_MINUTE) for t in all_ticks]
+    fractions = [[box.get(t) for t in all_ticks] for box in box_data]
+
+    raster_columns = [_pandas_column(f) for f in fractions]
+    final_columns = []
+    for f in fractions:
+        marks = {value: ['1' if code == value else '' for code in f] for value in (1, 2, 6)}
+        marks[1] = ['1' if code in (1, 2) else '' for code in f]
+        raster_columns.extend(marks[value] for value in (1, 2, 6))
+        final_columns.append(_pandas_column([1 if code in (1, 2) else None for code in f]))
+
+    boxes = range(1, 9)
+    raster = [['Absolute Time (minutes)'] + [f'Box {b} Fraction' for b in boxes] +
+              [f'Box {b}-{v}' for b in boxes for v in (1, 2, 6)]]
+    raster += [list(row) for row in zip(times, *raster_columns)]
+    final = [['Absolute Time (minutes)'] + [f'Box {b}-1' for b in boxes]]
+    final += [list(row) for row in zip(times, *final_columns)]
+    return raster, final
+
+
+def reference_bridge(final_base, final_nine, start_time, end_time):
+    """
+    The counting script's outer merge of two FINALOUTPUT tables over
+    [start_time, end_time].  Returns (bridged rows, counts).
+    """
+    def keyed(table):
+        rows = {}
+        for row in table[1:]:
+            time_value = float(row[0])
+            if start_time <= time_value <= end_time:
+                rows[time_value] = row[1:9]
+        return rows
+
+    base_rows, nine_rows = keyed(final_base), keyed(final_nine)
+    merged_times = sorted(set(base_rows) | set(nine_rows))
+    blank = [''] * 8
+    cells = [base_rows.get(t, blank) + nine_rows.get(t, blank) for t in merged_times]
+
+    # A box column stays int only if its FINALOUTPUT column had no blanks and
+    # the merge did not add any.
+    source_has_blank = ([any(r[i] == '' for r in final_base[1:]) for i in range(1, 9)] +
+                        [any(r[i] == '' for r in final_nine[1:]) for i in range(1, 9)])
+    columns = []
+    counts = []
+    for i in range(16):
+        column = [row[i] for row in cells]
+        values = [float(c) if c else None for c in column]
+        if source_has_blank[i] or any(v is None for v in values):
+            columns.append(['' if v is None else str(v) for v in values])
+        else:
+            columns.append([str(int(v)) for v in values])
+        counts.append(sum(1 for v in values if v == 1))
+
+    bridged = [['Absolute Time (minutes)'] + [f'Box {i}' for i in range(1, 17)]]
+    bridged += [[str(t)] + list(row) for t, row in zip(merged_times, zip(*columns))]
+    return bridged, counts
+
+
+# -- Checking ------------------------------------------------------------------
+def _read_rows(path):
+    with open(path, 'r', newline='') as f:
+        return list(csv.reader(f))
+
+
+def _compare(label, expected, actual):
+    """None if the two tables match, else a description of the first difference."""
+    if len(expected) != len(actual):
+        return f"{label}: {len(actual)} rows, expected {len(expected)}"
+    for n, (want, got) in enumerate(zip(expected, actual)):
+        if want != got:
+            return f"{label}, row {n}: {got} != expected {want}"
+    return None
+
+
+def check_outputs(halves, dirs, start_time, end_time):
+    """
+    Compares the pipeline's files in 'dirs' with the reference.  Returns
+    (number of files compared, list of mismatch descriptions).
+    """
+    problems = []
+    compared = 0
+    finals = {}
+    for input_directory, suffix in halves:
+        for file_name in sorted(os.listdir(input_directory)):
+            name = os.path.splitext(file_name)[0] + suffix
+            raster, final = reference_tables(reference_parse(os.path.join(input_directory, file_name)))
+            finals.setdefault(os.path.splitext(file_name)[0], []).append(final)
+            for stage, expected in (('raster', raster), ('final', final)):
+                path = os.path.join(dirs[stage], name + '.csv')
+                problems.append(_compare(path, expected, _read_rows(path)))
+                compared += 1
+
+    count_rows = [['File Name'] + [f'Box {i}' for i in range(1, 17)]]
+    for base, tables in finals.items():
+        if len(tables) != 2:
+            continue
+        bridged, counts = reference_bridge(tables[0], tables[1], start_time, end_time)
+        path = os.path.join(dirs['bridged'], base + '.csv')
+        problems.append(_compare(path, bridged, _read_rows(path)))
+        compared += 1
+        count_rows.append([base] + [str(c) for c in counts])
+
+    if len(halves) == 2:
+        path = os.path.join(dirs['bridged'], 'Final_Counts.csv')
+        actual = _read_rows(path)
+        # Final_Counts lists the bases in folder order; compare them sorted.
+        problems.append(_compare(path, count_rows[:1] + sorted(count_rows[1:]),
+                                 actual[:1] + sorted(actual[1:])))
+        compared += 1
+    return compared, [p for p in problems if p is not None]
+
+
+# -- Timing --------------------------------------------------------------------
+def _render(table):
+    """Renders (headers, rows) as CSV text in memory, as write_table would to disk."""
+    headers, rows = table
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def best_time(func, repeat):
+    """Best wall time of 'repeat' calls, and the result of the last one."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(func):
+    """Peak bytes allocated while 'func' runs, over what was allocated before."""
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def stage_functions(halves, start_time, end_time, bin_width, pipeline_dirs, workers):
+    """
+    The stage callables, in STAGES order.  Stages after 'parse' work from
+    sessions parsed once up front, so each one is timed on its own.
+    """
+    files = [(os.path.join(d, f), os.path.splitext(f)[0], suffix)
+             for d, suffix in halves for f in sorted(os.listdir(d))]
+    sessions = {(base, suffix): parse_medpc_file(path) for path, base, suffix in files}
+    pairs = [(sessions[(base, '')], sessions[(base, '_9-16')])
+             for _, base, suffix in files
+             if suffix == '' and (base, '_9-16') in sessions]
+    bins = make_bins(bin_width, end_time, start_time)
+
+    def parse():
+        return [parse_medpc_file(path) for path, _, _ in files]
+
+    def align():
+        return [s.align() for s in sessions.values()]
+
+    def raster():
+        return [_render(mouse_raster_rows(s)) for s in sessions.values()]
+
+    def final():
+        return [_render(mouse_final_rows(s)) for s in sessions.values()]
+
+    def bridge():
+        out = []
+        for base_session, nine_session in pairs:
+            text = io.StringIO()
+            merge_streams([events_stream(base_session), events_stream(nine_session)], [8, 8],
+                          csv.writer(text), start_time, end_time)
+            out.append(text.getvalue())
+        return out
+
+    def count():
+        counts = [merge_streams([events_stream(a), events_stream(b)], [8, 8], None,
+                                start_time, end_time) for a, b in pairs]
+        times = [box_times_from_streams([events_stream(a), events_stream(b)], [8, 8])
+                 for a, b in pairs]
+        return counts, binned_counts(times, bins)
+
+    def pipeline():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return run_mouse_pipeline(halves, pipeline_dirs, ('raster', 'final', 'bridged', 'counts'),
+                                      start_time, end_time, workers=workers)
+
+    n_events = sum(s.n_events() for s in sessions.values())
+    return [parse, align, raster, final, bridge, count, pipeline], n_events, len(files), len(pairs)
+
+
+# -- Startup -------------------------------------------------------------------
+def _run_python(args):
+    started = time.perf_counter()
+    done = subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, text=True, check=True)
+    return time.perf_counter() - started, done.stderr
+
+
+def imported_modules(script):
+    """The modules 'script --help' imports, from python -X importtime."""
+    _, log = _run_python(['-X', 'importtime', script, '--help'])
+    return [line.split('|')[-1].strip() for line in log.splitlines()
+            if line.startswith('import time:') and '|' in line][1:]  # skip the header line
+
+
+def startup_times(repeat=5):
+    """Prints the start-up time of every script; returns True if none loads pandas."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    bare = min(_run_python(['-c', 'pass'])[0] for _ in range(repeat))
+    print(f"bare interpreter {bare * 1000:.0f} ms (best of {repeat})")
+    print(f"{'script':<30}{'ms':>8}{'+ms':>8}{'modules':>9}  heavy libraries")
+    ok = True
+    for script in STARTUP_SCRIPTS:
+        path = os.path.join(here, script)
+        seconds = min(_run_python([path, '--help'])[0] for _ in range(repeat))
+        modules = imported_modules(path)
+        heavy = [m for m in HEAVY_MODULES if m in modules]
+        if 'pandas' in heavy:
+            ok = False
+        print(f"{script:<30}{seconds * 1000:>8.0f}{(seconds - bare) * 1000:>8.0f}"
+              f"{len(modules):>9}  {', '.join(heavy) or '-'}")
+    return ok
+
+
+def run_benchmark(halves, work_dir, start_time=0, end_time=180, bin_width=10, repeat=3,
+                  memory=True, check=True, workers=1):
+    """Times every stage, prints the report and returns True if the check passed."""
+    dirs = {stage: os.path.join(work_dir, stage) for stage in ('raster', 'final', 'bridged')}
+    functions, n_events, n_files, n_pairs = stage_functions(
+        halves, start_time, end_time, bin_width, dirs, workers)
+    print(f"{n_files} files, {n_pairs} bridged pairs, {n_events:,} kept events")
+    print(f"{'stage':<10}{'seconds':>10}{'events/s':>14}{'peak MB':>10}")
+
+    for stage, func in zip(STAGES, functions):
+        if stage in ('bridge', 'count') and not n_pairs:
+            print(f"{stage:<10}{'skipped (no 9-16 half)':>34}")
+            continue
+        seconds, _ = best_time(func, repeat)
+        rate = f"{n_events / seconds:,.0f}" if seconds > 0 else '-'
+        peak = f"{peak_memory(func) / 2**20:.1f}" if memory else '-'
+        print(f"{stage:<10}{seconds:>10.3f}{rate:>14}{peak:>10}")
+
+    if not check:
+        return True
+    compared, problems = check_outputs(halves, dirs, start_time, end_time)
+    if problems:
+        print(f"Check FAILED: {len(problems)} of {compared} files differ from the reference")
+        for problem in problems[:10]:
+            print(f"  {problem}")
+        return False
+    print(f"Check passed: {compared} files match the reference")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SA processing stages.")
+    parser.add_argument('--input', help="existing folder with 'files' (and 'files9-16') to "
+                                        "benchmark instead of a synthetic cohort")
+    parser.add_argument('--boxes', type=int, choices=[8, 16], default=16)
+    parser.add_argument('--files', type=int, default=10, help="sessions in the cohort (default 10)")
+    parser.add_argument('--minutes', type=float, default=180, help="session length (default 180)")
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help="average events per minute per box (default 2)")
+    parser.add_argument('--mix', default='1:0.7,2:0.1,6:0.1,3:0.1',
+                        help="fraction-code weights (default '1:0.7,2:0.1,6:0.1,3:0.1')")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start-time', type=float, default=0)
+    parser.add_argument('--end-time', type=float, default=180)
+    parser.add_argument('--bin-width', type=float, default=10)
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage (default 3)")
+    parser.add_argument('--workers', type=int, default=1, help="workers for the pipeline stage")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--no-check', action='store_true', help="skip the reference check")
+    parser.add_argument('--startup', action='store_true',
+                        help="time how long each script takes to start instead")
+    args = parser.parse_args()
+
+    if args.startup:
+        sys.exit(0 if startup_times(max(1, args.repeat)) else 1)
+
+    work_dir = tempfile.mkdtemp(prefix='sa_benchmark_')
+    try:
+        if args.input:
+            halves = [(os.path.join(args.input, 'files'), '')]
+            if os.path.isdir(os.path.join(args.input, 'files9-16')):
+                halves.append((os.path.join(args.input, 'files9-16'), '_9-16'))
+        else:
+            halves = write_cohort(os.path.join(work_dir, 'input'), args.files, args.boxes,
+                                  args.minutes, args.rate, parse_mix(args.mix), args.seed)
+        ok = run_benchmark(halves, work_dir, args.start_time, args.end_time, args.bin_width,
+                           max(1, args.repeat), not args.no_memory, not args.no_check, args.workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
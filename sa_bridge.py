@@ -0,0 +1,177 @@
+"""
+Streaming bridge engine for the 1-8 and 9-16 halves of a session.
+
+Each FINALOUTPUT file (or event file) is already sorted by absolute time, so
+bridging is a k-way merge: rows from every half are merged on time in one
+linear pass, the events per box are counted during the merge and each bridged
+row is written as soon as it is complete.  Memory stays bounded by the number
+of inputs and no global sort is needed.
+
+The bridged table has the time column followed by every box of every input in
+order ('Box 1' .. 'Box 16' for two halves of 8), with 1.0 where a box has an
+event and blank otherwise, as the pandas merge wrote it.
+"""
+import csv
+import heapq
+import os
+
+from medpc_parser import ticks_to_minutes
+from medpc_stream import AlignedStream
+from sa_io import atomic_path
+
+TIME_HEADER = 'Absolute Time (minutes)'
+
+
+# -- Input streams -------------------------------------------------------------
+def csv_stream(path, n_boxes=8):
+    """
+    Yields (time, cells) from a sorted FINALOUTPUT CSV: the time column as a
+    float and the first 'n_boxes' box columns as 1.0 or ''.  Rows whose time
+    is not a number are skipped, as are exact repeats of the previous row.
+    """
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None or len(header) < n_boxes + 1:
+            raise ValueError(f"{path} does not have enough columns.")
+        previous = None
+        for row in reader:
+            try:
+                time = float(row[0])
+            except (ValueError, IndexError):
+                continue
+            if time != time:  # NaN
+                continue
+            cells = [float(cell) if cell else '' for cell in row[1:n_boxes + 1]]
+            cells.extend([''] * (n_boxes - len(cells)))
+            if (time, cells) == previous:
+                continue
+            previous = (time, cells)
+            yield time, cells
+
+
+def events_stream(session, marks=(1, 2), columns=None):
+    """
+    Yields (time, cells) from a SessionEvents: one row per distinct tick, 1.0
+    in a box whose event code is in 'marks' (the "Box n-1" series by default).
+    'columns' picks other cells: a list of (box index, marks), one per cell.
+    """
+    all_ticks, box_codes = session.align()
+    if columns is None:
+        columns = [(i, marks) for i in range(len(box_codes))]
+    columns = [(box_codes[i], column_marks) for i, column_marks in columns]
+    for row_index, tick in enumerate(all_ticks):
+        yield ticks_to_minutes(tick), [1.0 if codes[row_index] in column_marks else ''
+                                       for codes, column_marks in columns]
+
+
+def raw_stream(input_file, columns, n_boxes=8, fractions=(1, 2, 6), where=None):
+    """
+    Yields (time, cells) like events_stream, streamed straight from a raw
+    MED-PC file (see medpc_stream) instead of a parsed session.  'columns'
+    is a list of (box index, marks).
+    """
+    with AlignedStream(input_file, n_boxes, fractions, where) as stream:
+        for tick, codes, _ in stream.rows():
+            yield ticks_to_minutes(tick), [1.0 if codes[i] in marks else '' for i, marks in columns]
+
+
+# -- Merging -------------------------------------------------------------------
+def merge_streams(streams, widths, writer=None, start_time=None, end_time=None):
+    """
+    Merges sorted (time, cells) streams on time.  'widths' gives the number of
+    box columns of each stream.  Rows from different streams at the same time
+    become one row; a stream without a row at that time contributes blanks.
+
+    Only times within [start_time, end_time] (either bound optional) are kept.
+    Each merged row is passed to 'writer.writerow' if a writer is given.
+    Returns the number of 1s per output box column.
+    """
+    offsets = [sum(widths[:i]) for i in range(len(widths))]
+    n_cells = sum(widths)
+    counts = [0] * n_cells
+
+    def tag(index, stream):
+        for time, cells in stream:
+            yield time, index, cells
+
+    merged = heapq.merge(*[tag(i, s) for i, s in enumerate(streams)], key=lambda item: item[0])
+
+    current_time = None
+    row = None
+
+    def flush():
+        for i, cell in enumerate(row):
+            if cell == 1:
+                counts[i] += 1
+        if writer is not None:
+            writer.writerow([current_time] + row)
+
+    for time, index, cells in merged:
+        if start_time is not None and time < start_time:
+            continue
+        if end_time is not None and time > end_time:
+            break  # every stream is sorted, nothing later can be in the window
+        if time != current_time:
+            if row is not None:
+                flush()
+            current_time = time
+            row = [''] * n_cells
+        offset = offsets[index]
+        for i, cell in enumerate(cells):
+            if cell != '':
+                row[offset + i] = cell
+    if row is not None:
+        flush()
+    return counts
+
+
+def bridge_to_file(streams, widths, bridged_file_path, start_time=None, end_time=None,
+                   headers=None):
+    """
+    Merges 'streams' into a bridged CSV written as it goes; returns the
+    per-box counts.  'headers' names the box columns ('Box 1' .. by default).
+    """
+    headers = [TIME_HEADER] + (headers or [f"Box {i}" for i in range(1, sum(widths) + 1)])
+    # Written under a temporary name, so a failed merge leaves no half-written file.
+    with atomic_path(bridged_file_path) as temp_path:
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            return merge_streams(streams, widths, writer, start_time, end_time)
+
+
+# -- Pairing the halves --------------------------------------------------------
+def pair_halves(directory, extensions=('.csv',), marker='_9-16'):
+    """
+    Groups the files in 'directory' by base name (the 9-16 file carries
+    'marker' in its name).  Returns {base: (base_file, nine_file)} for every
+    base that has exactly those two files and reports the others.
+    """
+    files_by_base = {}
+    for file_name in os.listdir(directory):
+        if file_name.lower().endswith(extensions):
+            base = os.path.splitext(file_name.replace(marker, ''))[0]
+            files_by_base.setdefault(base, []).append(file_name)
+
+    pairs = {}
+    for base, files in files_by_base.items():
+        if len(files) != 2:
+            print(f"Skipping base '{base}' because it does not have exactly 2 matching files.")
+            continue
+        base_file = next((f for f in files if marker not in f), None)
+        nine_file = next((f for f in files if marker in f), None)
+        if not (base_file and nine_file):
+            print(f"Skipping base '{base}' because files don't match the expected pattern.")
+            continue
+        pairs[base] = (base_file, nine_file)
+    return pairs
+
+
+def write_counts(path, count_rows, n_boxes=16, headers=None):
+    """Writes Final_Counts.csv ('File Name', 'Box 1'.. or 'headers') in a single write."""
+    with atomic_path(path) as temp_path:
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['File Name'] + (headers or [f"Box {i}" for i in range(1, n_boxes + 1)]))
+            writer.writerows(count_rows)
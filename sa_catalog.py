@@ -0,0 +1,432 @@
+"""
+Session catalog: decoded events and session metadata in one SQLite file.
+
+Answering "how many responses did M12 make over days 3-10 in the
+first 60 minutes" meant re-reading the bridged CSVs and re-running the
+counting script with edited globals.  The catalog keeps, for every box of
+every raw file loaded into it, the session's metadata
+
+    base name, species (mouse/rat), half (1-8/9-16, mouse only), box,
+    subject, date, and day (1 = the subject's first session date)
+
+and its decoded events (10 ms tick and fraction code), stored in
+(session, code, tick) order so that counting a window is one index range per
+session.  Queries over a whole cohort take milliseconds:
+
+    python sa_catalog.py load catalog.sqlite C:\\...\\SAD\\files C:\\...\\SAD\\files9-16
+    python sa_catalog.py counts catalog.sqlite --where subject=M12,half=9-16 --days 3-10 --end-time 60
+    python sa_catalog.py windows catalog.sqlite --bin-width 10 --end-time 180 --by subject
+    python sa_catalog.py events catalog.sqlite --where subject=M12 --days 3 --out M12_day3.csv
+
+Loading is incremental: a file whose size and mtime are unchanged is not read
+again, and a changed file (or the same session loaded from another folder)
+replaces its earlier rows.  The processing scripts can also load each session
+as they parse it (--catalog).  Keep the catalog on a local disk, not in the
+synced folder: SQLite's locking does not survive file syncing.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from itertools import count, repeat
+
+from medpc_index import parse_where
+from medpc_parser import TICKS_PER_MINUTE, parse_medpc_file
+from sa_counts import make_bins, parse_windows, window_label
+from sa_manifest import normalize_params
+from sa_pipeline import series_marks
+from sa_plots import half_first_box, input_files, parse_codes
+
+# Boxes per raw file and the fraction codes kept, as in the processing scripts.
+SPECIES = {'mouse': (8, (1, 2, 6)), 'rat': (16, (1,))}
+# A response, as counted in the 'Box n-1' series and Final_Counts.csv.
+RESPONSE_CODES = series_marks(1)
+SESSION_COLUMNS = ('base', 'species', 'half', 'box', 'subject', 'date', 'day', 'n_events')
+FILTER_FIELDS = ('base', 'species', 'half', 'box', 'subject', 'date', 'day')
+GROUPINGS = {  # --by: the session columns a row is keyed on
+    'session': ('base', 'species', 'half', 'box', 'subject', 'date', 'day'),
+    'subject': ('species', 'subject'),
+    'day': ('species', 'day'),
+    'box': ('species', 'half', 'box'),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    params TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    base TEXT NOT NULL,
+    species TEXT NOT NULL,
+    half TEXT,
+    box INTEGER NOT NULL,
+    subject TEXT,
+    date TEXT,
+    n_events INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_file ON sessions (file_id);
+CREATE INDEX IF NOT EXISTS sessions_subject ON sessions (species, subject, date);
+CREATE INDEX IF NOT EXISTS sessions_base ON sessions (species, base);
+CREATE TABLE IF NOT EXISTS events (
+    session_id INTEGER NOT NULL,
+    code INTEGER NOT NULL,
+    tick INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (session_id, code, tick, n)
+) WITHOUT ROWID;
+CREATE VIEW IF NOT EXISTS session_days AS
+    SELECT sessions.*,
+           dense_rank() OVER (PARTITION BY species, subject ORDER BY date) AS day
+    FROM sessions;
+"""
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def iso_date(text):
+    """'01/31/24' (MED-PC's Start Date) -> '2024-01-31'; other text is kept as is."""
+    if not text:
+        return None
+    parts = text.strip().split('/')
+    if len(parts) == 3 and all(p.isdigit() for p in parts):
+        month, day, year = (int(p) for p in parts)
+        if year < 100:
+            year += 2000
+        return f"{year:04d}-{month:02d}-{day:02d}"
+    return text.strip()
+
+
+def mouse_half(path):
+    """'9-16' for a file of the 9-16 folder (see sa_plots.half_first_box), else '1-8'."""
+    return '9-16' if half_first_box(path) == 9 else '1-8'
+
+
+def _filter_sql(where=None, days=None, dates=None, alias=''):
+    """WHERE clause (and its parameters) over session_days for the query filters."""
+    clauses, params = [], []
+    for field, wanted in (where or {}).items():
+        column = field.strip().lower()
+        if column not in FILTER_FIELDS:
+            raise ValueError(f"Unknown field '{field}' (use {', '.join(FILTER_FIELDS)})")
+        values = list(wanted) if isinstance(wanted, (list, tuple, set, frozenset)) else [wanted]
+        if column in ('box', 'day'):
+            values = [int(v) for v in values]
+        else:
+            values = [str(v) for v in values]
+        clauses.append(f"{alias}{column} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    if days is not None:
+        clauses.append(f"{alias}day BETWEEN ? AND ?")
+        params.extend(days)
+    if dates is not None:
+        since, until = dates
+        if since:
+            clauses.append(f"{alias}date >= ?")
+            params.append(iso_date(since))
+        if until:
+            clauses.append(f"{alias}date <= ?")
+            params.append(iso_date(until))
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def _load_params(species, half, where):
+    # Stored with each file: the same filter given with lists or tuples, or
+    # with its keys in another order, gives the same text.
+    return json.dumps(normalize_params([species, half, where]), sort_keys=True)
+
+
+class Catalog:
+    """
+    One catalog file.  Use as a context manager (or call close()).  Several
+    processes can load into the same catalog; each file is one transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- Loading ---------------------------------------------------------------
+    def is_current(self, input_file, species='mouse', half=None, where=None):
+        """True if 'input_file' is loaded, unchanged, with the same species, half and filter."""
+        row = self.db.execute('SELECT size, mtime_ns, params FROM files WHERE path = ?',
+                              (os.path.abspath(input_file),)).fetchone()
+        return (row is not None and os.path.isfile(input_file) and
+                tuple(row) == _stat(input_file) + (_load_params(species, half, where),))
+
+    def _remove(self, path, base, species, half):
+        # The file itself, and a copy of the same session loaded from elsewhere.
+        rows = self.db.execute('SELECT id FROM files WHERE path = ? UNION '
+                               'SELECT file_id FROM sessions WHERE species = ? AND base = ? AND half IS ?',
+                               (path, species, base, half)).fetchall()
+        for row in rows:
+            self.db.execute('DELETE FROM events WHERE session_id IN '
+                            '(SELECT id FROM sessions WHERE file_id = ?)', row)
+            self.db.execute('DELETE FROM sessions WHERE file_id = ?', row)
+            self.db.execute('DELETE FROM files WHERE id = ?', row)
+
+    def add_session(self, input_file, session, species='mouse', half=None, where=None):
+        """
+        Stores the boxes of a parsed SessionEvents read from 'input_file',
+        replacing whatever was loaded from that file, or for the same base
+        name, species and half, before.  Boxes with
+        neither events nor headers (left out by 'where') are not stored.
+        Returns the number of box sessions stored.
+        """
+        path = os.path.abspath(input_file)
+        base = os.path.splitext(os.path.basename(input_file))[0]
+        first_box = 9 if half == '9-16' else 1
+        stored = 0
+        with self.db:
+            self._remove(path, base, species, half)
+            file_id = self.db.execute(
+                'INSERT INTO files (path, size, mtime_ns, params) VALUES (?, ?, ?, ?)',
+                (path,) + _stat(input_file) + (_load_params(species, half, where),)).lastrowid
+            for i in range(session.n_boxes):
+                headers = session.headers[i]
+                ticks = session.ticks[i]
+                if headers is None and not ticks:
+                    continue
+                headers = headers or {}
+                session_id = self.db.execute(
+                    'INSERT INTO sessions (file_id, base, species, half, box, subject, date, n_events) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (file_id, base, species, half, first_box + i, headers.get('Subject') or None,
+                     iso_date(headers.get('Start Date')), len(ticks))).lastrowid
+                self.db.executemany('INSERT INTO events VALUES (?, ?, ?, ?)',
+                                    zip(repeat(session_id), session.codes[i], ticks, count()))
+                stored += 1
+        return stored
+
+    def load_file(self, input_file, species='mouse', half=None, where=None):
+        """Parses a raw file and stores it (see add_session)."""
+        n_boxes, fractions = SPECIES[species]
+        session = parse_medpc_file(input_file, n_boxes=n_boxes, fractions=fractions, where=where)
+        return self.add_session(input_file, session, species, half, where)
+
+    def load(self, paths, species='mouse', where=None, full=False):
+        """
+        Loads every raw file under 'paths' (files or folders) that is new or
+        changed, or every file with 'full'.  Mouse files get their half from
+        their folder.  Returns the number of files loaded.
+        """
+        if species not in SPECIES:
+            raise ValueError(f"Unknown species '{species}' (use {', '.join(SPECIES)})")
+        loaded = 0
+        for input_file in input_files(paths):
+            half = mouse_half(input_file) if species == 'mouse' else None
+            if not full and self.is_current(input_file, species, half, where):
+                continue
+            try:
+                stored = self.load_file(input_file, species, half, where)
+            except Exception as e:
+                print(f"Failed to load {input_file}. Error: {type(e).__name__}: {e}")
+                continue
+            loaded += 1
+            print(f"Loaded {input_file} ({stored} boxes)")
+        return loaded
+
+    # -- Queries ---------------------------------------------------------------
+    def sessions(self, where=None, days=None, dates=None):
+        """
+        The box sessions matching the filters, as dicts of SESSION_COLUMNS,
+        by species, subject, day and box.  'where' maps FILTER_FIELDS to a
+        value or a list of values; 'days' is (first, last) day number and
+        'dates' is (since, until), either end may be None.
+        """
+        sql, params = _filter_sql(where, days, dates)
+        rows = self.db.execute(f"SELECT id, {', '.join(SESSION_COLUMNS)} FROM session_days{sql} "
+                               f"ORDER BY species, subject, day, base, box", params)
+        return [dict(zip(('id',) + SESSION_COLUMNS, row)) for row in rows]
+
+    def window_counts(self, windows, codes=RESPONSE_CODES, where=None, days=None, dates=None):
+        """
+        Events with a code in 'codes' per matching session and window, in one
+        pass over the events.  'windows' are (start, end[, include_end]) in
+        minutes, as in sa_counts.  Returns (sessions, counts): counts has one
+        list per session with one count per window.
+        """
+        sessions = self.sessions(where, days, dates)
+        if not sessions or not windows:
+            return sessions, [[0] * len(windows) for _ in sessions]
+        sums, params = [], []
+        for window in windows:
+            include_end = window[2] if len(window) > 2 else True
+            sums.append(f"SUM(tick >= ? AND tick {'<=' if include_end else '<'} ?)")
+            params += [window[0] * TICKS_PER_MINUTE, window[1] * TICKS_PER_MINUTE]
+        codes = list(codes)
+        sql, filter_params = _filter_sql(where, days, dates)
+        rows = self.db.execute(
+            f"SELECT session_id, {', '.join(sums)} FROM events "
+            f"WHERE session_id IN (SELECT id FROM session_days{sql}) "
+            f"AND code IN ({', '.join('?' * len(codes))}) AND tick >= ? AND tick <= ? "
+            f"GROUP BY session_id",
+            params + filter_params + codes +
+            [min(w[0] for w in windows) * TICKS_PER_MINUTE,
+             max(w[1] for w in windows) * TICKS_PER_MINUTE])
+        by_id = {row[0]: list(row[1:]) for row in rows}
+        return sessions, [by_id.get(s['id'], [0] * len(windows)) for s in sessions]
+
+    def counts(self, start_time=0, end_time=None, codes=RESPONSE_CODES, where=None, days=None, dates=None):
+        """Events per matching session in [start_time, end_time]; returns (sessions, counts)."""
+        end_time = float('inf') if end_time is None else end_time
+        sessions, counts = self.window_counts([(start_time, end_time)], codes, where, days, dates)
+        return sessions, [c[0] for c in counts]
+
+    def events(self, codes=None, start_time=0, end_time=None, where=None, days=None, dates=None):
+        """
+        Yields (session dict, time in minutes, code) for every event of the
+        matching sessions in [start_time, end_time], session by session in
+        time order.  'codes' None gives every stored code.
+        """
+        sql, params = _filter_sql(where, days, dates, alias='s.')
+        sql += (' AND ' if sql else ' WHERE ') + 'e.tick >= ?'
+        params.append(start_time * TICKS_PER_MINUTE)
+        if end_time is not None:
+            sql += ' AND e.tick <= ?'
+            params.append(end_time * TICKS_PER_MINUTE)
+        if codes is not None:
+            codes = list(codes)
+            sql += f" AND e.code IN ({', '.join('?' * len(codes))})"
+            params += codes
+        columns = ', '.join('s.' + c for c in SESSION_COLUMNS)
+        rows = self.db.execute(f"SELECT s.id, {columns}, e.tick, e.code FROM session_days s "
+                               f"JOIN events e ON e.session_id = s.id{sql} "
+                               f"ORDER BY s.species, s.subject, s.day, s.base, s.box, e.n", params)
+        sessions = {}
+        for row in rows:
+            session = sessions.get(row[0])
+            if session is None:
+                session = sessions[row[0]] = dict(zip(('id',) + SESSION_COLUMNS, row[:-2]))
+            yield session, row[-2] / TICKS_PER_MINUTE, row[-1]
+
+
+def summarize(sessions, counts, by='session'):
+    """
+    Sums per-session count lists over the sessions sharing the GROUPINGS[by]
+    columns.  Returns (key columns, rows) with rows as key values + counts.
+    """
+    keys = GROUPINGS[by]
+    totals = {}
+    for session, session_counts in zip(sessions, counts):
+        key = tuple(session[k] for k in keys)
+        total = totals.setdefault(key, [0] * len(session_counts))
+        for i, n in enumerate(session_counts):
+            total[i] += n
+    return list(keys), [list(key) + total for key, total in totals.items()]
+
+
+def _parse_range(text):
+    """Parses '3-10' into (3, 10) and '3' into (3, 3)."""
+    first, sep, last = text.partition('-')
+    return int(first), int(last if sep else first)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load raw session files into a SQLite catalog and query it.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help="load new or changed raw files")
+    load.add_argument('catalog')
+    load.add_argument('inputs', nargs='+', help="raw files or folders ('files9-16' folders are the 9-16 half)")
+    load.add_argument('--species', choices=sorted(SPECIES), default='mouse')
+    load.add_argument('--where', type=parse_where,
+                      help="only load boxes whose header fields match, e.g. 'Subject=M1|M2'")
+    load.add_argument('--full', action='store_true', help="reload every file")
+
+    for name, help_text in (('sessions', "list the matching sessions"),
+                            ('counts', "count events per session in one window"),
+                            ('windows', "count events per session in several windows"),
+                            ('events', "list the events of the matching sessions")):
+        query = commands.add_parser(name, help=help_text)
+        query.add_argument('catalog')
+        query.add_argument('--where', type=parse_where,
+                           help=f"e.g. 'subject=M1|M2,half=9-16' (fields: {', '.join(FILTER_FIELDS)})")
+        query.add_argument('--days', type=_parse_range, help="day numbers of each subject, e.g. 3-10")
+        query.add_argument('--since', help="first date (YYYY-MM-DD or MM/DD/YY)")
+        query.add_argument('--until', help="last date (YYYY-MM-DD or MM/DD/YY)")
+        query.add_argument('--out', help="write the CSV here instead of to the screen")
+        if name == 'sessions':
+            continue
+        query.add_argument('--codes', type=parse_codes, default=None if name == 'events' else RESPONSE_CODES,
+                           help="fraction codes to count (default 1,2: responses)" if name != 'events'
+                           else "fraction codes to list (default all)")
+        query.add_argument('--start-time', type=float, default=0, help="minutes (default 0)")
+        query.add_argument('--end-time', type=float, help="minutes (default: no limit)")
+        if name in ('counts', 'windows'):
+            query.add_argument('--by', choices=list(GROUPINGS), default='session',
+                               help="one row per session (default), subject, day or box")
+        if name == 'windows':
+            query.add_argument('--windows', type=parse_windows, help="e.g. '0-60,60-180'")
+            query.add_argument('--bin-width', type=float, action='append', default=[],
+                               help="fixed-width bins over [start-time, end-time] (repeatable)")
+    args = parser.parse_args()
+
+    with Catalog(args.catalog) as catalog:
+        if args.command == 'load':
+            loaded = catalog.load(args.inputs, args.species, args.where, args.full)
+            print(f"Loaded {loaded} files into {args.catalog}")
+            sys.exit(0)
+
+        filters = dict(where=args.where, days=args.days,
+                       dates=(args.since, args.until) if args.since or args.until else None)
+        if args.command == 'sessions':
+            headers = list(SESSION_COLUMNS)
+            rows = [[s[c] for c in SESSION_COLUMNS] for s in catalog.sessions(**filters)]
+        elif args.command == 'events':
+            headers = list(GROUPINGS['session']) + ['Time (minutes)', 'Code']
+            rows = ([s[c] for c in GROUPINGS['session']] + [time, code]
+                    for s, time, code in catalog.events(args.codes, args.start_time, args.end_time,
+                                                        **filters))
+        else:
+            if args.command == 'counts':
+                windows = [(args.start_time, float('inf') if args.end_time is None else args.end_time)]
+                labels = ['Count']
+            else:
+                windows = list(args.windows or [])
+                for bin_width in args.bin_width:
+                    if args.end_time is None:
+                        parser.error("--bin-width needs --end-time")
+                    windows += make_bins(bin_width, args.end_time, args.start_time)
+                if not windows:
+                    parser.error("give --windows or --bin-width")
+                labels = [window_label(w) for w in windows]
+            sessions, counts = catalog.window_counts(windows, args.codes, **filters)
+            keys, rows = summarize(sessions, counts, args.by)
+            headers = keys + labels
+
+        out = open(args.out, 'w', newline='') if args.out else sys.stdout
+        try:
+            writer = csv.writer(out)
+            writer.writerow(headers)
+            writer.writerows(rows)
+        except BrokenPipeError:
+            # The reader stopped early (e.g. '| head'): exit quietly, and point stdout at
+            # devnull so flushing it at exit does not raise again.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        finally:
+            if args.out:
+                out.close()
+                print(f"Saved to {args.out}")
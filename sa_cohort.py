@@ -0,0 +1,200 @@
+"""
+Cohort aggregates kept up to date in the session catalog.
+
+The daily cohort output - responses per subject per day, and whether each
+subject has met the acquisition criteria - used to be rebuilt by hand from
+Final_Counts.csv, which the counting script rewrites from scratch.  Here the
+response count of every box session is stored next to the session in the
+catalog (see sa_catalog), one small row per session and measure (codes and
+time window).  update() only counts the sessions that have no row yet, so
+adding a day of data costs the new sessions' events, not the cohort's; a
+reloaded file drops its rows (a trigger on the sessions table) and is
+counted again.  The tables below are read from those rows:
+
+    Cohort_Counts.csv    one row per subject, day and box: date, responses
+    Learning_Curves.csv  one row per subject, one column per day
+    Acquisition.csv      per subject: the last sessions, their variation and
+                         the first day the criteria were met
+
+The acquisition criteria are met on the first day where the last 'sessions'
+sessions all have at least 'threshold' responses and each lies within
+'max_variation' percent of their mean.
+
+    python sa_cohort.py catalog.sqlite --out C:\\...\\SAD\\BRIDGEDFINALOUTPUT --sessions 3 --threshold 10 --variation 20
+"""
+import argparse
+import os
+
+from medpc_index import parse_where
+from medpc_parser import TICKS_PER_MINUTE
+from sa_catalog import RESPONSE_CODES, Catalog, _filter_sql
+from sa_pipeline import write_table
+from sa_plots import parse_codes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_counts (
+    session_id INTEGER NOT NULL,
+    measure TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (session_id, measure)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS session_counts_forget AFTER DELETE ON sessions
+BEGIN
+    DELETE FROM session_counts WHERE session_id = OLD.id;
+END;
+"""
+
+
+def measure_name(codes=RESPONSE_CODES, start_time=0, end_time=180):
+    """The key of a measure in session_counts, e.g. '1,2@0-180'."""
+    end = 'end' if end_time is None else f"{end_time:g}"
+    return f"{','.join(str(c) for c in codes)}@{start_time:g}-{end}"
+
+
+# -- Aggregates ----------------------------------------------------------------
+def update(catalog, codes=RESPONSE_CODES, start_time=0, end_time=180):
+    """
+    Counts the responses (events with a code in 'codes' in [start_time,
+    end_time]) of every session that has no count for this measure yet.
+    Returns the number of sessions counted.
+    """
+    catalog.db.executescript(SCHEMA)
+    codes = list(codes)
+    end_tick = float('inf') if end_time is None else end_time * TICKS_PER_MINUTE
+    with catalog.db:
+        cursor = catalog.db.execute(
+            f"INSERT INTO session_counts (session_id, measure, count) "
+            f"SELECT s.id, ?, (SELECT count(*) FROM events e WHERE e.session_id = s.id "
+            f"AND e.code IN ({', '.join('?' * len(codes))}) AND e.tick >= ? AND e.tick <= ?) "
+            f"FROM sessions s WHERE NOT EXISTS (SELECT 1 FROM session_counts c "
+            f"WHERE c.session_id = s.id AND c.measure = ?)",
+            [measure_name(codes, start_time, end_time)] + codes +
+            [start_time * TICKS_PER_MINUTE, end_tick, measure_name(codes, start_time, end_time)])
+    return cursor.rowcount
+
+
+def daily_counts(catalog, measure, where=None):
+    """
+    Responses per subject, day and box as (species, subject, day, date, box,
+    responses) rows, by subject, day and box.
+    """
+    sql, params = _filter_sql(where, alias='d.')
+    return catalog.db.execute(
+        f"SELECT d.species, d.subject, d.day, d.date, d.box, SUM(c.count) "
+        f"FROM session_days d JOIN session_counts c ON c.session_id = d.id AND c.measure = ?{sql} "
+        f"GROUP BY d.species, d.subject, d.day, d.box ORDER BY d.species, d.subject, d.day, d.box",
+        [measure] + params).fetchall()
+
+
+def learning_curves(rows):
+    """
+    {(species, subject): [(day, responses), ...]} from daily_counts rows, with
+    the responses of a subject's boxes on the same day added up.
+    """
+    days = {}
+    for species, subject, day, _, _, responses in rows:
+        key = (species, subject, day)
+        days[key] = days.get(key, 0) + responses
+    curves = {}
+    for (species, subject, day), responses in days.items():
+        curves.setdefault((species, subject), []).append((day, responses))
+    return curves
+
+
+# -- Criteria ------------------------------------------------------------------
+def variation(counts):
+    """Largest distance of a count from the mean of 'counts', in percent of the mean."""
+    mean = sum(counts) / len(counts)
+    if mean == 0:
+        return 0.0
+    return max(abs(c - mean) for c in counts) / mean * 100
+
+
+def acquisition(curve, sessions=3, threshold=10, max_variation=20.0):
+    """
+    Checks a learning curve ([(day, responses), ...] in day order) against
+    the acquisition criteria.  Returns (first day met or None, mean and
+    variation of the last 'sessions' sessions, or None if there are fewer).
+    """
+    counts = [responses for _, responses in curve]
+    met = None
+    for end in range(sessions, len(counts) + 1):
+        window = counts[end - sessions:end]
+        if min(window) >= threshold and variation(window) < max_variation:
+            met = curve[end - 1][0]
+            break
+    if len(counts) < sessions:
+        return met, None, None
+    last = counts[-sessions:]
+    return met, sum(last) / sessions, variation(last)
+
+
+# -- Outputs -------------------------------------------------------------------
+def write_cohort_tables(out_dir, rows, sessions=3, threshold=10, max_variation=20.0):
+    """
+    Writes Cohort_Counts.csv, Learning_Curves.csv and Acquisition.csv from
+    daily_counts rows.  Returns the acquisition rows.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    write_table(os.path.join(out_dir, 'Cohort_Counts.csv'),
+                ['Species', 'Subject', 'Day', 'Date', 'Box', 'Responses'], rows)
+
+    curves = learning_curves(rows)
+    n_days = max((day for curve in curves.values() for day, _ in curve), default=0)
+    curve_rows = []
+    for (species, subject), curve in curves.items():
+        by_day = dict(curve)
+        curve_rows.append([species, subject] + [by_day.get(d, '') for d in range(1, n_days + 1)])
+    write_table(os.path.join(out_dir, 'Learning_Curves.csv'),
+                ['Species', 'Subject'] + [f'Day {d}' for d in range(1, n_days + 1)], curve_rows)
+
+    acquisition_rows = []
+    for (species, subject), curve in curves.items():
+        met, mean, spread = acquisition(curve, sessions, threshold, max_variation)
+        acquisition_rows.append([species, subject, len(curve),
+                                 '' if mean is None else round(mean, 2),
+                                 '' if spread is None else round(spread, 1),
+                                 'yes' if met is not None else 'no', '' if met is None else met])
+    write_table(os.path.join(out_dir, 'Acquisition.csv'),
+                ['Species', 'Subject', 'Sessions', f'Mean (last {sessions})',
+                 f'Variation % (last {sessions})', 'Criteria met', 'Day met'], acquisition_rows)
+    return acquisition_rows
+
+
+def update_cohort(catalog_path, out_dir, codes=RESPONSE_CODES, start_time=0, end_time=180, where=None,
+                  sessions=3, threshold=10, max_variation=20.0):
+    """
+    Counts the new sessions of the catalog and rewrites the cohort tables in
+    'out_dir'.  Returns the acquisition rows.
+    """
+    with Catalog(catalog_path) as catalog:
+        counted = update(catalog, codes, start_time, end_time)
+        rows = daily_counts(catalog, measure_name(codes, start_time, end_time), where)
+    acquisition_rows = write_cohort_tables(out_dir, rows, sessions, threshold, max_variation)
+    n_met = sum(row[5] == 'yes' for row in acquisition_rows)
+    print(f"Cohort tables saved to {out_dir} ({counted} new sessions counted; "
+          f"{n_met} of {len(acquisition_rows)} subjects met the acquisition criteria)")
+    return acquisition_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the cohort counts, learning curves and "
+                                                 "acquisition criteria from a session catalog.")
+    parser.add_argument('catalog', help="session catalog (see sa_catalog.py)")
+    parser.add_argument('--out', required=True, help="folder for the cohort tables")
+    parser.add_argument('--codes', type=parse_codes, default=RESPONSE_CODES,
+                        help="fraction codes counted as responses (default 1,2)")
+    parser.add_argument('--start-time', type=float, default=0, help="minutes (default 0)")
+    parser.add_argument('--end-time', type=float, default=180, help="minutes (default 180)")
+    parser.add_argument('--where', type=parse_where,
+                        help="only these sessions, e.g. 'species=mouse' or 'subject=M1|M2'")
+    parser.add_argument('--sessions', type=int, default=3,
+                        help="consecutive sessions the criteria look at (default 3)")
+    parser.add_argument('--threshold', type=int, default=10,
+                        help="fewest responses in each of those sessions (default 10)")
+    parser.add_argument('--variation', type=float, default=20.0,
+                        help="largest distance from their mean, in percent (default 20)")
+    args = parser.parse_args()
+
+    update_cohort(args.catalog, args.out, args.codes, args.start_time, args.end_time, args.where,
+                  args.sessions, args.threshold, args.variation)
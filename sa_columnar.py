@@ -0,0 +1,107 @@
+"""
+Sparse, typed event files written alongside the dense wide CSVs.
+
+The aligned CSVs have one row per distinct event time across all boxes and are
+mostly blank.  An event file instead stores one row per decoded event in long
+format:
+
+    box   (int16, 1-based box number within the file)
+    tick  (int64, cumulative time in 10 ms ticks)
+    code  (int8, MED-PC fraction code)
+
+plus the number of boxes in the file.  The format follows the extension:
+'.npz' needs NumPy, '.parquet' and '.feather' need pyarrow.  Both are only
+imported when such a file is written or read.  The CSV outputs stay as they
+are for the people who open them in Excel.
+"""
+import os
+from array import array
+from bisect import bisect_right
+
+from medpc_parser import SessionEvents
+
+EVENT_EXTENSIONS = ('.npz', '.parquet', '.feather')
+
+
+def _columns(session):
+    """Flattens a SessionEvents into box/tick/code arrays."""
+    box = array('h')
+    tick = array('q')
+    code = array('b')
+    for i in range(session.n_boxes):
+        box.extend([i + 1] * len(session.ticks[i]))
+        tick.extend(session.ticks[i])
+        code.extend(session.codes[i])
+    return box, tick, code
+
+
+def write_events(session, path):
+    """Writes a SessionEvents as a long-format event file (format from the extension)."""
+    box, tick, code = _columns(session)
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.npz':
+        import numpy as np
+        np.savez_compressed(path,
+                            box=np.frombuffer(box, dtype=np.int16),
+                            tick=np.frombuffer(tick, dtype=np.int64),
+                            code=np.frombuffer(code, dtype=np.int8),
+                            n_boxes=np.array(session.n_boxes))
+    elif ext in ('.parquet', '.feather'):
+        import pyarrow as pa
+        table = pa.table({'box': pa.array(box, type=pa.int16()),
+                          'tick': pa.array(tick, type=pa.int64()),
+                          'code': pa.array(code, type=pa.int8())},
+                         metadata={'n_boxes': str(session.n_boxes)})
+        if ext == '.parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, path)
+    else:
+        raise ValueError(f"Unsupported event file type '{ext}' (use one of {EVENT_EXTENSIONS})")
+
+
+def read_events(path):
+    """Reads an event file back into a SessionEvents."""
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.npz':
+        import numpy as np
+        with np.load(path) as data:
+            n_boxes = int(data['n_boxes'])
+            box, tick, code = data['box'], data['tick'], data['code']
+            box, tick, code = box.tolist(), tick.tolist(), code.tolist()
+    elif ext in ('.parquet', '.feather'):
+        if ext == '.parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(path)
+        else:
+            import pyarrow.feather as feather
+            table = feather.read_table(path)
+        n_boxes = int(table.schema.metadata[b'n_boxes'])
+        box = table.column('box').to_pylist()
+        tick = table.column('tick').to_pylist()
+        code = table.column('code').to_pylist()
+    else:
+        raise ValueError(f"Unsupported event file type '{ext}' (use one of {EVENT_EXTENSIONS})")
+
+    # Rows are written box by box in event order, so each box is one slice.
+    session = SessionEvents(n_boxes)
+    start = 0
+    for i in range(n_boxes):
+        end = bisect_right(box, i + 1, start)
+        session.ticks[i].extend(tick[start:end])
+        session.codes[i].extend(code[start:end])
+        start = end
+    return session
+
+
+def find_events(directory, name):
+    """Path of the event file for 'name' in 'directory' (any supported format), or None."""
+    for ext in EVENT_EXTENSIONS:
+        path = os.path.join(directory, name + ext)
+        if os.path.isfile(path):
+            return path
+    return None
@@ -0,0 +1,143 @@
+"""
+Event counts in many time windows at once.
+
+The counting script only counts one [start_time, end_time] window.  Here the
+sorted event times of every box are counted in a whole list of windows in one
+call: each window costs two binary searches per box (numpy.searchsorted when
+NumPy is installed, bisect otherwise) instead of a re-filter of the table.
+binned_counts() does every session, box and window of a cohort with one
+searchsorted over all the event times.
+
+A window is (start, end) in minutes and includes both ends, like the
+start_time/end_time filter.  make_bins() returns fixed-width bins as
+(start, end, include_end) with only the last bin including its end, so an
+event on a bin edge is counted once.
+"""
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+_np = False  # the numpy module, None without NumPy; looked up on first use
+
+
+def _numpy():
+    # Imported on first count, not at import time: importing NumPy costs
+    # more than a short counting run, and the scripts must start without it.
+    global _np
+    if _np is False:
+        try:
+            import numpy
+        except ImportError:  # counts fall back to bisect and nested lists
+            numpy = None
+        _np = numpy
+    return _np
+
+
+# -- Windows -------------------------------------------------------------------
+def make_bins(bin_width, end, start=0):
+    """Consecutive bins of 'bin_width' minutes covering [start, end]."""
+    if bin_width <= 0:
+        raise ValueError("bin width must be positive")
+    bins = []
+    edge = start
+    while edge < end:
+        bins.append((edge, min(edge + bin_width, end), False))
+        edge += bin_width
+    if bins:
+        bins[-1] = (bins[-1][0], bins[-1][1], True)
+    return bins
+
+
+def parse_windows(text):
+    """Parses '0-60,60-180' into [(0.0, 60.0), (60.0, 180.0)]."""
+    windows = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        if not sep:
+            raise ValueError(f"Window '{part}' is not of the form start-end")
+        windows.append((float(start), float(end)))
+    return windows
+
+
+def window_label(window):
+    """'start-end' label used in output files."""
+    return f"{window[0]:g}-{window[1]:g}"
+
+
+# -- Event times ---------------------------------------------------------------
+def box_times_from_streams(streams, widths):
+    """
+    Collects the sorted event times of every box from (time, cells) streams
+    (see sa_bridge): a box has an event at 'time' where its cell is 1.
+    """
+    box_times = [[] for _ in range(sum(widths))]
+    offset = 0
+    for stream, width in zip(streams, widths):
+        for time, cells in stream:
+            for i, cell in enumerate(cells[:width]):
+                if cell == 1:
+                    box_times[offset + i].append(time)
+        offset += width
+    return box_times
+
+
+# -- Counting ------------------------------------------------------------------
+def _edges(windows):
+    starts = [w[0] for w in windows]
+    ends = [w[1] for w in windows]
+    include_end = [w[2] if len(w) > 2 else True for w in windows]
+    return starts, ends, include_end
+
+
+def window_counts(times, windows):
+    """Number of the sorted 'times' in each window."""
+    starts, ends, include_end = _edges(windows)
+    np = _numpy()
+    if np is not None:
+        times = np.asarray(times, dtype=float)
+        lo = np.searchsorted(times, starts, side='left')
+        hi = np.where(include_end,
+                      np.searchsorted(times, ends, side='right'),
+                      np.searchsorted(times, ends, side='left'))
+        return (hi - lo).tolist()
+    return [(bisect_right(times, e) if inc else bisect_left(times, e)) - bisect_left(times, s)
+            for s, e, inc in zip(starts, ends, include_end)]
+
+
+def binned_counts(sessions, windows):
+    """
+    Counts for every session, box and window.  'sessions' is a list of per-box
+    sorted event-time lists (all with the same number of boxes).  Returns a
+    (session x box x window) integer array, or nested lists without NumPy.
+    """
+    np = _numpy()
+    if np is None:
+        return [[window_counts(times, windows) for times in box_times] for box_times in sessions]
+    n_boxes = len(sessions[0]) if sessions else 0
+    shape = (len(sessions), n_boxes, len(windows))
+    groups = [times for box_times in sessions for times in box_times]
+    if not groups or not windows:
+        return np.zeros(shape, dtype=np.int64)
+
+    # All the times in one sorted array: the times of group g (session x box)
+    # are shifted by g strides, a stride being longer than all times and
+    # windows together, so each group's window edges land among its own times.
+    # Open-ended edges (e.g. an end of inf) are first brought within half a
+    # minute of the times, which counts the same and keeps the stride finite.
+    sizes = np.fromiter(map(len, groups), dtype=np.int64, count=len(groups))
+    times = np.fromiter(chain.from_iterable(groups), dtype=float, count=int(sizes.sum()))
+    starts, ends, include_end = (np.asarray(x, dtype=float) for x in _edges(windows))
+    finite = np.concatenate((times, starts, ends))
+    finite = finite[np.isfinite(finite)]
+    low, high = (finite.min(), finite.max()) if finite.size else (0.0, 0.0)
+    starts = np.clip(starts, low - 0.5, high + 0.5)
+    ends = np.clip(ends, low - 0.5, high + 0.5)
+    offsets = np.arange(len(groups)) * (high - low + 1) - low
+    keys = times + np.repeat(offsets, sizes)
+    lo = np.searchsorted(keys, offsets[:, None] + starts, side='left')
+    hi = np.where(include_end,
+                  np.searchsorted(keys, offsets[:, None] + ends, side='right'),
+                  np.searchsorted(keys, offsets[:, None] + ends, side='left'))
+    return (hi - lo).reshape(shape)
@@ -0,0 +1,228 @@
+"""
+Overlapped file I/O for the processing scripts.
+
+The inputs and outputs live in OneDrive-synced folders, where every open,
+read and write can stall.  Run serially, the CPU waits while a file is read
+or written and the disk waits while it is parsed.  run_overlapped() runs the
+per-file workers as a pipeline instead:
+
+    reader threads  -> prefetch the next raw files into memory
+    worker(s)       -> parse from memory, render the output tables
+    writer threads  -> write the outputs, each with an atomic rename
+
+At most 'in_flight' files are between being read and being written, which
+bounds the memory used.  The outputs are exactly the same.
+
+Workers take part through two calls: prefetched(path) gives the bytes read
+ahead for an input (None when not running overlapped), and write_file(path,
+data) writes an output - straight away, or handed to the writer threads
+when running overlapped.  Either way the file appears under its name in one
+os.replace, so a stalled or interrupted write never leaves half a file.
+"""
+import contextlib
+import os
+import threading
+
+from sa_batch import _run_captured
+
+DEFAULT_IN_FLIGHT = 4
+DEFAULT_IO_THREADS = 4
+
+# Set while a worker runs under run_overlapped (per process; one worker at a time).
+_prefetched = {}   # input path -> bytes
+_captured = None   # list of (path, data) to write, or None to write directly
+
+
+# -- Atomic writes -------------------------------------------------------------
+def _temp_path(path):
+    # Same folder (so os.replace is a rename) and same extension (writers
+    # like numpy pick the format from it).  The host name keeps machines that
+    # share the folder (see sa_shard) from picking the same name.
+    import socket  # here, not at start-up (see sa_benchmark --startup)
+
+    root, ext = os.path.splitext(path)
+    return f"{root}.tmp-{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}{ext}"
+
+
+def atomic_write(path, data):
+    """Writes 'data' (str or bytes) to a temporary file and renames it to 'path'."""
+    temp = _temp_path(path)
+    try:
+        if isinstance(data, str):
+            with open(temp, 'w', newline='') as f:
+                f.write(data)
+        else:
+            with open(temp, 'wb') as f:
+                f.write(data)
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Yields a temporary path to write 'path' through; renamed into place on success."""
+    temp = _temp_path(path)
+    try:
+        yield temp
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
+
+
+def write_file(path, data):
+    """
+    Writes an output file atomically, or queues it for the writer threads
+    when running under run_overlapped.  Returns its size in bytes.
+    """
+    size = len(data.encode('utf-8') if isinstance(data, str) else data)
+    if _captured is not None:
+        _captured.append((path, data))
+    else:
+        atomic_write(path, data)
+    return size
+
+
+def prefetched(path):
+    """The bytes of 'path' read ahead by run_overlapped, or None."""
+    return _prefetched.get(path)
+
+
+# -- Pipeline ------------------------------------------------------------------
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _run_deferred(worker, task, data):
+    """Runs worker(*task) with its input prefetched and its writes captured."""
+    global _captured
+    _prefetched[task[0]] = data
+    _captured = []
+    try:
+        try:
+            return worker(*task), None, _captured
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}", []
+    finally:
+        _prefetched.clear()
+        _captured = None
+
+
+def _run_deferred_captured(worker, task, data):
+    # In a pool process: also capture the log, as sa_batch does.
+    (result, error, writes), worker_error, log = _run_captured(_run_deferred, (worker, task, data))
+    return result, error or worker_error, writes, log
+
+
+def run_overlapped(worker, tasks, in_flight=DEFAULT_IN_FLIGHT, max_workers=1,
+                   io_threads=DEFAULT_IO_THREADS):
+    """
+    Like sa_batch.run_batch, with each task's input file (its first item)
+    read ahead on 'io_threads' reader threads and the files the worker
+    writes with write_file() written by as many writer threads.  At most
+    'in_flight' files are read but not yet written.  Returns
+    (task, result, error) in task order; a failed write is the task's error.
+
+    With max_workers=1 the workers run in this process, otherwise on a
+    process pool of that size.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    tasks = list(tasks)
+    slots = threading.BoundedSemaphore(max(in_flight, 1))
+
+    outcomes = []
+    with contextlib.ExitStack() as stack:
+        readers = stack.enter_context(ThreadPoolExecutor(io_threads))
+        writers = stack.enter_context(ThreadPoolExecutor(io_threads))
+        pool = None
+        if max_workers > 1 and len(tasks) > 1:
+            pool = stack.enter_context(ProcessPoolExecutor(min(max_workers, len(tasks))))
+
+        reads = []    # read futures, in task order
+        running = []  # (task, future) of worker calls in the pool, in task order
+        pending = []  # (task, result, error, write futures)
+
+        def collect(task, result, error, writes):
+            futures = [writers.submit(atomic_write, path, data) for path, data in writes]
+            pending.append((task, result, error, futures))
+            if not futures:
+                slots.release()
+                return
+            # The file's slot is free once all its outputs are written.
+            remaining = [len(futures)]
+            lock = threading.Lock()
+
+            def written(_):
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        slots.release()
+            for future in futures:
+                future.add_done_callback(written)
+
+        def finish(task, future):
+            try:
+                result, error, writes, log = future.result()
+            except Exception as e:  # the worker process itself died
+                result, error, writes, log = None, f"{type(e).__name__}: {e}", [], ''
+            if log:
+                print(log, end='')
+            if error is not None:
+                print(f"Failed to process {task[0]}. Error: {error}")
+            collect(task, result, error, writes)
+
+        def read_ahead(index):
+            # Slots are taken here, in task order, so reads never wait on later files.
+            while len(reads) < len(tasks):
+                if not slots.acquire(blocking=False):
+                    if len(reads) > index:
+                        return  # this file is already on its way
+                    if running:
+                        finish(*running.pop(0))  # frees a slot once its outputs are written
+                        continue
+                    slots.acquire()  # only writes are outstanding
+                reads.append(readers.submit(_read, tasks[len(reads)][0]))
+
+        for index, task in enumerate(tasks):
+            read_ahead(index)
+            try:
+                data = reads[index].result()
+            except OSError as e:
+                slots.release()
+                error = f"{type(e).__name__}: {e}"
+                print(f"Failed to process {task[0]}. Error: {error}")
+                pending.append((task, None, error, []))
+                continue
+            if pool is None:
+                result, error, writes = _run_deferred(worker, task, data)
+                if error is not None:
+                    print(f"Failed to process {task[0]}. Error: {error}")
+                collect(task, result, error, writes)
+            else:
+                running.append((task, pool.submit(_run_deferred_captured, worker, task, data)))
+                # Replay finished workers in task order so the log stays stable.
+                while running and running[0][1].done():
+                    finish(*running.pop(0))
+        for task, future in running:
+            finish(task, future)
+
+        for task, result, error, futures in pending:
+            for future in futures:
+                try:
+                    future.result()
+                except OSError as e:
+                    if error is None:
+                        error = f"{type(e).__name__}: {e}"
+                        print(f"Failed to write the outputs of {task[0]}. Error: {error}")
+                        result = None
+            outcomes.append((task, result, error))
+    # Keep the input order even where reads failed before earlier workers finished.
+    order = {id(task): i for i, task in enumerate(tasks)}
+    outcomes.sort(key=lambda outcome: order[id(outcome[0])])
+    return outcomes
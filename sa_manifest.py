@@ -0,0 +1,161 @@
+"""
+Manifest cache for incremental re-runs.
+
+The manifest is a small JSON file that remembers, for every output the scripts
+build, which source files it was built from (size, mtime and content hash), the
+parameters used (box count, fractions, time window, ...) and the outputs that
+were written.  On the next run an entry whose sources, parameters and outputs
+are all unchanged is skipped.
+
+A source whose mtime changed but whose size did not is re-hashed before it is
+treated as changed, since synced folders often touch files without editing
+them.
+
+The processing and counting scripts share one manifest file, and the watch
+mode keeps its copy open between polls.  save() therefore re-reads the file
+and writes back only the entries this process changed, so one script never
+drops what another recorded in the meantime.
+"""
+import hashlib
+import json
+import os
+
+from sa_io import atomic_write
+
+MANIFEST_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_params(params):
+    """
+    'params' as they read back from the JSON manifest (tuples become lists,
+    keys strings), so parameters built in code compare equal to stored ones.
+    """
+    return json.loads(json.dumps(params))
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class Manifest:
+    """
+    Maps (section, key) to the sources, parameters and outputs of one build
+    step, e.g. ('raster', input file) or ('bridged', base name).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sections = self._read()
+        self.dirty = False
+        self._changed = set()  # (section, key) recorded or updated since the last save
+        self._cleared = set()  # sections forgotten since the last save
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {self.path}. Error: {e}")
+            return {}
+        if data.get('version') != MANIFEST_VERSION:
+            return {}
+        return data.get('sections', {})
+
+    def clear(self):
+        """Forgets every entry so the next run rebuilds everything."""
+        self._cleared.update(self.sections)
+        self.sections = {}
+        self.dirty = True
+
+    def get(self, section, key):
+        return self.sections.get(section, {}).get(key)
+
+    def is_current(self, section, key, sources, params, outputs):
+        """
+        True if the entry exists with the same parameters, every source is
+        unchanged and every output still exists as it was written.
+        """
+        entry = self.get(section, key)
+        if entry is None or entry['params'] != normalize_params(params):
+            return False
+        if sorted(entry['sources']) != sorted(os.path.abspath(s) for s in sources):
+            return False
+        if sorted(entry['outputs']) != sorted(os.path.abspath(o) for o in outputs):
+            return False
+
+        for path, recorded in entry['outputs'].items():
+            if not os.path.isfile(path) or list(_stat(path)) != recorded:
+                return False
+
+        for path, recorded in entry['sources'].items():
+            if not os.path.isfile(path):
+                return False
+            size, mtime_ns = _stat(path)
+            if size != recorded['size']:
+                return False
+            if mtime_ns != recorded['mtime_ns']:
+                if file_digest(path) != recorded['sha256']:
+                    return False
+                # Touched but not edited: remember the new mtime.
+                recorded['mtime_ns'] = mtime_ns
+                self._changed.add((section, key))
+                self.dirty = True
+        return True
+
+    def record(self, section, key, sources, params, outputs, **extra):
+        """Stores the current state of 'sources' and 'outputs' for an entry."""
+        entry = {
+            'params': normalize_params(params),
+            'sources': {},
+            'outputs': {},
+        }
+        for path in sources:
+            path = os.path.abspath(path)
+            size, mtime_ns = _stat(path)
+            entry['sources'][path] = {'size': size, 'mtime_ns': mtime_ns,
+                                      'sha256': file_digest(path)}
+        for path in outputs:
+            path = os.path.abspath(path)
+            entry['outputs'][path] = list(_stat(path))
+        entry.update(extra)
+        self.sections.setdefault(section, {})[key] = entry
+        self._changed.add((section, key))
+        self.dirty = True
+
+    def save(self):
+        """
+        Writes the manifest (atomically) if anything changed: the file as it
+        is now on disk, with this process's changes merged in.
+        """
+        if not self.dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        sections = self._read()
+        for section in self._cleared:
+            sections.pop(section, None)
+        for section, key in self._changed:
+            entry = self.get(section, key)
+            if entry is not None:
+                sections.setdefault(section, {})[key] = entry
+            elif key in sections.get(section, {}):
+                del sections[section][key]
+        atomic_write(self.path, json.dumps({'version': MANIFEST_VERSION, 'sections': sections},
+                                           indent=1))
+        # Keep what the other scripts recorded, too.
+        self.sections = sections
+        self._changed.clear()
+        self._cleared.clear()
+        self.dirty = False
@@ -0,0 +1,522 @@
+"""
+End-to-end, in-memory pipeline for the mouse workflow.
+
+Before, the stages only talked through disk: run_raster_plot_parsing ran once
+per half, the column selection re-read every CSV in 'Raster ready', the bridge
+re-read FINALOUTPUT and the counting script re-read it again.  Here every raw
+file is parsed exactly once and the decoded session is carried through all
+stages in memory:
+
+    parse -> raster-ready table -> final columns -> bridge 1-8 with 9-16 -> counts
+
+Each stage's file is optional ('outputs'); the CSVs that are written are the
+same as the ones the scripts wrote before.
+
+The FINALOUTPUT columns are declared by meaning, as (box, fraction) series
+(FINAL_SERIES, "box N, fraction 1" for every box), instead of the old list of
+Excel letters picked out of the raster-ready table.  Only those series are
+built; the fraction 2/6 columns only exist if the raster-ready table itself
+is asked for.
+"""
+import csv
+import io
+import os
+
+from medpc_parser import parse_medpc_file, ticks_to_minutes
+from medpc_stream import AlignedStream, write_tables
+from sa_batch import run_batch
+from sa_bridge import bridge_to_file, csv_stream, events_stream, merge_streams, raw_stream, write_counts
+from sa_columnar import read_events, write_events
+from sa_io import atomic_path, prefetched, run_overlapped, write_file
+from sa_report import FileStats, RunReport, profile_call
+
+TIME_HEADER = 'Absolute Time (minutes)'
+FRACTION_VALUES = (1, 2, 6)
+
+# Output series, by meaning: (box, fraction) of one half.  The FINALOUTPUT
+# table, the bridge and the counts use the "box N, fraction 1" series of every
+# box (the old Excel columns A, J, M, ..., AE of the raster-ready table).
+FINAL_SERIES = tuple((box, 1) for box in range(1, 9))
+
+# Stage outputs that can be written; 'aligned' is the old intermediate CSV and
+# 'raster' the full raster-ready table with every fraction column.
+ALL_OUTPUTS = ('aligned', 'raster', 'final', 'events', 'bridged', 'counts')
+DEFAULT_OUTPUTS = ('final', 'bridged', 'counts')
+
+
+# -- Tables --------------------------------------------------------------------
+def write_table(path, headers, rows):
+    """Writes a CSV table atomically (see sa_io.write_file); returns its size."""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return write_file(path, text.getvalue())
+
+
+def _number_format(codes):
+    # A column with any blank cell went through pandas as float64 ('1.0').
+    return float if None in codes else int
+
+
+# -- Series --------------------------------------------------------------------
+def series_marks(fraction):
+    """Codes that mark a series: fraction 1 also counts fraction 2 responses."""
+    return (1, 2) if fraction == 1 else (fraction,)
+
+
+VALUE_MARKS = [series_marks(value) for value in FRACTION_VALUES]  # raster-ready 'Box n-x' columns
+
+
+def series_label(box, fraction):
+    return f'Box {box}-{fraction}'
+
+
+def bridged_label(box, fraction):
+    """Bridged/counts column name: 'Box n' for the fraction 1 series, as before."""
+    return f'Box {box}' if fraction == 1 else series_label(box, fraction)
+
+
+def parse_series(text):
+    """Parses '1-1,2-1,3-6' (box-fraction) into [(1, 1), (2, 1), (3, 6)]."""
+    series = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        box, sep, fraction = part.partition('-')
+        if not sep:
+            raise ValueError(f"Series '{part}' is not of the form box-fraction")
+        series.append((int(box), int(fraction)))
+    return series
+
+
+def series_columns(series):
+    """(box index, marks) of each series, the form events_stream takes."""
+    return [(box - 1, series_marks(fraction)) for box, fraction in series]
+
+
+def _aligned_row(tick, codes, deltas):
+    row = [ticks_to_minutes(tick)]
+    for code, delta in zip(codes, deltas):
+        if code is None:
+            row.extend(['', ''])
+        else:
+            row.extend([f"{delta}.{code}00", code])
+    return row
+
+
+def _raster_row(tick, codes, formats):
+    row = [ticks_to_minutes(tick)]
+    row.extend('' if code is None else fmt(code) for code, fmt in zip(codes, formats))
+    for code in codes:
+        row.extend(1 if code in marks else '' for marks in VALUE_MARKS)
+    return row
+
+
+def _final_row(tick, codes, columns, formats):
+    row = [ticks_to_minutes(tick)]
+    row.extend(fmt(1) if codes[i] in marks else '' for (i, marks), fmt in zip(columns, formats))
+    return row
+
+
+def aligned_headers(n_boxes):
+    return [TIME_HEADER] + [f'Box {i+1} {x}' for i in range(n_boxes) for x in ('Raw Data', 'Fraction')]
+
+
+def raster_headers(n_boxes):
+    boxes = range(1, n_boxes + 1)
+    return ([TIME_HEADER] + [f'Box {box} Fraction' for box in boxes] +
+            [series_label(box, value) for box in boxes for value in FRACTION_VALUES])
+
+
+def final_headers(series):
+    return [TIME_HEADER] + [series_label(box, fraction) for box, fraction in series]
+
+
+def mouse_aligned_rows(session):
+    """The old intermediate aligned table (Raw Data re-rendered from the tick delta)."""
+    all_ticks, box_codes = session.align()
+    deltas = []
+    for ticks in session.ticks:
+        lookup = {}
+        previous = 0
+        for tick in ticks:
+            lookup[tick] = tick - previous
+            previous = tick
+        deltas.append(lookup)
+
+    rows = []
+    for row_index, tick in enumerate(all_ticks):
+        codes = [c[row_index] for c in box_codes]
+        rows.append(_aligned_row(tick, codes, [d.get(tick) for d in deltas]))
+    return aligned_headers(session.n_boxes), rows
+
+
+def mouse_raster_rows(session, aligned=None):
+    """
+    The raster-ready table: time, one Fraction column per box, then
+    'Box n-1', 'Box n-2', 'Box n-6' per box with 1 where the fraction matches
+    (fraction 2 also marks 'Box n-1').  'aligned' is session.align() if the
+    caller already has it.
+    """
+    all_ticks, box_codes = aligned or session.align()
+    formats = [_number_format(codes) for codes in box_codes]
+    rows = [_raster_row(tick, [c[row_index] for c in box_codes], formats)
+            for row_index, tick in enumerate(all_ticks)]
+    return raster_headers(session.n_boxes), rows
+
+
+def mouse_final_rows(session, series=FINAL_SERIES, aligned=None):
+    """
+    The FINALOUTPUT table: time plus one column per (box, fraction) series,
+    'Box n-1' of every box by default.  Only these columns are built.
+    """
+    all_ticks, box_codes = aligned or session.align()
+    columns = series_columns(series)
+    # A column with any row outside its marks has a blank cell (float format).
+    formats = [_number_format([c if c in marks else None for c in box_codes[i]])
+               for i, marks in columns]
+    rows = [_final_row(tick, [c[row_index] for c in box_codes], columns, formats)
+            for row_index, tick in enumerate(all_ticks)]
+    return final_headers(series), rows
+
+
+def write_streamed_tables(input_file, paths, series=FINAL_SERIES, where=None):
+    """
+    Writes the aligned, raster-ready and FINALOUTPUT tables in 'paths' from
+    one streamed pass over the raw file (see medpc_stream), with memory that
+    does not grow with the session.  The files are the same as the in-memory
+    path writes.  Returns the number of events decoded per box.
+    """
+    with AlignedStream(input_file, n_boxes=8, fractions=FRACTION_VALUES, where=where) as stream:
+        tables = []
+        if 'aligned' in paths:
+            tables.append((paths['aligned'], aligned_headers(8), _aligned_row))
+        if 'raster' in paths:
+            formats = [int if full else float
+                       for full in stream.always([(i, FRACTION_VALUES) for i in range(8)])]
+            tables.append((paths['raster'], raster_headers(8),
+                           lambda tick, codes, _: _raster_row(tick, codes, formats)))
+        if 'final' in paths:
+            columns = series_columns(series)
+            final_formats = [int if full else float for full in stream.always(columns)]
+            tables.append((paths['final'], final_headers(series),
+                           lambda tick, codes, _: _final_row(tick, codes, columns, final_formats)))
+        write_tables(stream.rows(), tables)
+        return stream.events_per_box
+
+
+# -- Per-file stage (runs in the batch workers) --------------------------------
+def output_paths(name, dirs, outputs, events_format=None):
+    """The per-file files written for session 'name' (base name plus half suffix)."""
+    paths = {}
+    if 'aligned' in outputs:
+        paths['aligned'] = os.path.join(dirs['aligned'], name + '.txt')
+    if 'raster' in outputs:
+        paths['raster'] = os.path.join(dirs['raster'], name + '.csv')
+    if 'final' in outputs:
+        paths['final'] = os.path.join(dirs['final'], name + '.csv')
+    if 'events' in outputs:
+        paths['events'] = os.path.join(dirs['events'], name + '.' + (events_format or 'npz'))
+    return paths
+
+
+def process_mouse_file(input_file, paths, profile_path=None, where=None, series=FINAL_SERIES,
+                       streaming=False, catalog=None):
+    """
+    Parses one raw file and writes its per-file outputs, the FINALOUTPUT
+    table with the given 'series'.  Returns the session and a FileStats with
+    the time of each step.  With 'profile_path' the parse runs under cProfile
+    and its stats are dumped there.  'where' keeps only the boxes whose header
+    fields match (see parse_medpc_file).
+
+    With 'streaming' the tables are written straight from the raw file
+    (write_streamed_tables) and no session is kept: None is returned for it.
+    'catalog' is (catalog path, half): the session is also loaded into that
+    session catalog (see sa_catalog).
+    """
+    stats = FileStats.for_input(input_file)
+    if streaming:
+        with stats.stage('stream'):
+            if profile_path:
+                stats.events_per_box = profile_call(profile_path, write_streamed_tables,
+                                                    input_file, paths, series, where)
+            else:
+                stats.events_per_box = write_streamed_tables(input_file, paths, series, where)
+        for path in paths.values():
+            stats.wrote(path)
+            print(f"Streamed output saved to {path}")
+        return None, stats
+
+    with stats.stage('parse'):
+        if profile_path:
+            session = profile_call(profile_path, parse_medpc_file, input_file,
+                                   n_boxes=8, fractions=FRACTION_VALUES, where=where,
+                                   data=prefetched(input_file))
+        else:
+            session = parse_medpc_file(input_file, n_boxes=8, fractions=FRACTION_VALUES,
+                                       where=where, data=prefetched(input_file))
+    stats.events_per_box = [len(ticks) for ticks in session.ticks]
+    aligned = session.align() if 'raster' in paths or 'final' in paths else None
+
+    if 'aligned' in paths:
+        with stats.stage('aligned'):
+            size = write_table(paths['aligned'], *mouse_aligned_rows(session))
+        stats.wrote(paths['aligned'], size)
+        print(f"Aligned absolute time data successfully written to {paths['aligned']}")
+    if 'raster' in paths:
+        with stats.stage('raster'):
+            size = write_table(paths['raster'], *mouse_raster_rows(session, aligned))
+        stats.wrote(paths['raster'], size)
+        print(f"Processed data saved to {paths['raster']}")
+    if 'final' in paths:
+        with stats.stage('final'):
+            size = write_table(paths['final'], *mouse_final_rows(session, series, aligned))
+        stats.wrote(paths['final'], size)
+        print(f"Final output saved to {paths['final']}")
+    if 'events' in paths:
+        with stats.stage('events'):
+            with atomic_path(paths['events']) as temp_path:
+                write_events(session, temp_path)
+        stats.wrote(paths['events'])
+        print(f"Event table saved to {paths['events']}")
+    if catalog is not None:
+        from sa_catalog import Catalog  # only with a catalog
+
+        catalog_path, half = catalog
+        with stats.stage('catalog'):
+            with Catalog(catalog_path) as db:
+                db.add_session(input_file, session, 'mouse', half, where)
+        print(f"Session loaded into the catalog {catalog_path}")
+    return session, stats
+
+
+# -- Pipeline ------------------------------------------------------------------
+def _half_stream(name, input_file, sessions, paths, stats, series, where):
+    """
+    The (time, cells) stream of one half: in memory if parsed this run, else
+    from its FINALOUTPUT or event file, else streamed from the raw file.
+    """
+    if name in sessions:
+        return events_stream(sessions[name], columns=series_columns(series))
+    if 'final' in paths and os.path.isfile(paths['final']):
+        stats.read(paths['final'])
+        return csv_stream(paths['final'], len(series))
+    if 'events' in paths and os.path.isfile(paths['events']):
+        stats.read(paths['events'])
+        return events_stream(read_events(paths['events']), columns=series_columns(series))
+    if os.path.isfile(input_file):
+        stats.read(input_file)
+        return raw_stream(input_file, series_columns(series), 8, FRACTION_VALUES, where)
+    raise ValueError(f"No data for '{name}'")
+
+
+def run_mouse_pipeline(halves, dirs, outputs=DEFAULT_OUTPUTS, start_time=0, end_time=180,
+                       workers=1, manifest=None, events_format=None, report=None,
+                       profile_dir=None, exclude=(), where=None, series=FINAL_SERIES,
+                       streaming=False, in_flight=0, catalog_path=None):
+    """
+    Runs every stage of the mouse workflow with each raw file parsed once.
+
+    'halves' is a list of (input_directory, suffix), normally the 1-8 folder
+    with suffix '' and the 9-16 folder with suffix '_9-16'.  'dirs' maps each
+    output in 'outputs' to its folder ('counts' goes to dirs['bridged']).
+    Bridged files and Final_Counts.csv cover [start_time, end_time].
+
+    With a 'manifest', raw files that are unchanged and still have their
+    outputs are not parsed again, and a base name is only re-bridged and
+    re-counted when one of its two raw files changed.  Returns the counts
+    rows, one per bridged base name.
+
+    Timings, sizes, skips and failures go to 'report' (a RunReport) if one
+    is given.  With 'profile_dir' each file's parse is profiled into
+    '<name>.prof' there.  Raw files in 'exclude' (e.g. ones MED-PC is still
+    writing) are left out of this run, and so is their base name's bridge.
+    'where' (e.g. {'Subject': ['M1', 'M2']}) keeps only the boxes whose
+    header fields match; the others are left empty without being decoded.
+    'series' are the (box, fraction) series of each half written to
+    FINALOUTPUT, bridged and counted.
+
+    With 'streaming' every file is streamed from disk instead of parsed into
+    memory (see medpc_stream), for very long sessions; the outputs are the
+    same, but 'events' cannot be written that way.
+
+    'in_flight' > 0 overlaps the file I/O with the parsing (see sa_io): the
+    next raw files are read ahead and the outputs written in the background,
+    with at most that many files in flight.
+
+    With 'catalog_path' every parsed session is also loaded into that session
+    catalog (see sa_catalog), and files missing from it are parsed even if
+    their outputs are up to date.
+    """
+    series = [tuple(s) for s in series]
+    if streaming and 'events' in outputs:
+        raise ValueError("The 'events' output needs whole sessions in memory; "
+                         "it cannot be written in streaming mode")
+    if streaming and in_flight:
+        raise ValueError("Streaming mode reads and writes as it goes; it cannot be combined "
+                         "with read-ahead (in_flight)")
+    if streaming and catalog_path:
+        raise ValueError("The catalog is loaded from whole sessions in memory; "
+                         "it cannot be filled in streaming mode")
+    if report is None:
+        report = RunReport('mouse pipeline')
+    catalog = None
+    if catalog_path:
+        from sa_catalog import Catalog
+
+        catalog = Catalog(catalog_path)
+    outputs = tuple(outputs)
+    for stage in outputs:
+        if stage not in ALL_OUTPUTS:
+            raise ValueError(f"Unknown output '{stage}' (use {', '.join(ALL_OUTPUTS)})")
+        os.makedirs(dirs['bridged' if stage == 'counts' else stage], exist_ok=True)
+
+    file_params = {'species': 'mouse', 'boxes': 8, 'fractions': list(FRACTION_VALUES),
+                   'timebase': 'ticks', 'events_format': events_format, 'where': where,
+                   'series': series}
+
+    # -- Stage 1: parse every raw file once (in batch mode) and write its files --
+    inputs = []          # (base, name, input_file, paths) in listing order per half
+    suffixes = {}        # input_file -> suffix of its half
+    tasks = []
+    for input_directory, suffix in halves:
+        for file_name in os.listdir(input_directory):
+            input_file = os.path.join(input_directory, file_name)
+            if not os.path.isfile(input_file):
+                print(f"Skipping directory: {file_name}")
+                report.skip(input_file, 'parse', 'directory')
+                continue
+            if input_file in exclude:
+                print(f"Still being written, skipping: {file_name}")
+                report.skip(input_file, 'parse', 'still being written')
+                continue
+            base = os.path.splitext(file_name)[0]
+            name = base + suffix
+            paths = output_paths(name, dirs, outputs, events_format)
+            inputs.append((base, name, input_file, paths))
+            suffixes[input_file] = suffix
+
+            params = dict(file_params, suffix=suffix)
+            reusable = 'final' in paths or 'events' in paths
+            half = suffix.lstrip('_') or '1-8'
+            if (manifest is not None and reusable and
+                    manifest.is_current('raster', input_file, [input_file], params, list(paths.values())) and
+                    (catalog is None or catalog.is_current(input_file, 'mouse', half, where))):
+                print(f"Unchanged, skipping: {file_name}")
+                report.skip(input_file, 'parse', 'unchanged since the last run')
+                continue
+            profile_path = os.path.join(profile_dir, name + '.prof') if profile_dir else None
+            tasks.append((input_file, paths, profile_path, where, series, streaming,
+                          (catalog_path, half) if catalog is not None else None))
+    if catalog is not None:
+        catalog.close()  # the workers load the sessions
+
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    sessions = {}
+    failed = set()
+    with report.stage('files'):
+        if in_flight:
+            outcomes = run_overlapped(process_mouse_file, tasks, in_flight, max_workers=workers)
+        else:
+            outcomes = run_batch(process_mouse_file, tasks, max_workers=workers)
+    names = {input_file: name for _, name, input_file, _ in inputs}
+    for (input_file, paths, *_), result, error in outcomes:
+        if error is not None:
+            failed.add(names[input_file])
+            report.fail(input_file, 'parse', error)
+            continue
+        session, stats = result
+        if session is not None:
+            sessions[names[input_file]] = session
+        report.add_file(stats)
+        if manifest is not None:
+            manifest.record('raster', input_file, [input_file],
+                            dict(file_params, suffix=suffixes[input_file]), list(paths.values()))
+
+    if 'bridged' not in outputs and 'counts' not in outputs:
+        return []
+
+    # -- Stage 2: bridge each base name's halves and count, in one merge --------
+    by_base = {}
+    for base, name, input_file, paths in inputs:
+        by_base.setdefault(base, []).append((name, input_file, paths))
+
+    bridge_params = {'start_time': start_time, 'end_time': end_time, 'bridge': 'merge',
+                     'halves': [suffix for _, suffix in halves],
+                     'series': series}
+    # Half h's boxes are numbered from 8 * h + 1 in the bridged file.
+    headers = [bridged_label(box + 8 * h, fraction)
+               for h in range(len(halves)) for box, fraction in series]
+    count_rows = []
+    with report.stage('bridge'):
+        for base, members in by_base.items():
+            row = bridge_base(base, members, len(halves), sessions, failed, dirs, outputs,
+                              start_time, end_time, manifest, bridge_params, report,
+                              series, headers, where)
+            if row is not None:
+                count_rows.append(row)
+
+    # -- Stage 3: Final_Counts.csv in a single write -----------------------------
+    if 'counts' in outputs:
+        with report.stage('counts'):
+            final_counts_path = os.path.join(dirs['bridged'], 'Final_Counts.csv')
+            write_counts(final_counts_path, count_rows, headers=headers)
+        print(f"Final counts saved to {final_counts_path}")
+    return count_rows
+
+
+def bridge_base(base, members, n_halves, sessions, failed, dirs, outputs,
+                start_time, end_time, manifest, bridge_params, report, series, headers,
+                where=None):
+    """
+    Bridges and counts one base name; returns its counts row or None if
+    skipped.  'members' are the (name, input file, output paths) of its
+    halves, 'sessions' the halves parsed in this run (re-read from their
+    outputs otherwise) and 'failed' the names that failed.  With a
+    'manifest', an unchanged base reuses its counts.
+    """
+    if len(members) != n_halves:
+        print(f"Skipping base '{base}' because it does not have exactly {n_halves} matching files.")
+        report.skip(base, 'bridge', f"{len(members)} of {n_halves} halves present")
+        return None
+    if any(name in failed for name, _, _ in members):
+        print(f"Skipping base '{base}' because one of its files failed.")
+        report.skip(base, 'bridge', 'one of its files failed')
+        return None
+
+    sources = [input_file for _, input_file, _ in members]
+    bridged_file_path = os.path.join(dirs['bridged'], base + '.csv')
+    bridged_outputs = [bridged_file_path] if 'bridged' in outputs else []
+    if (manifest is not None and all(name not in sessions for name, _, _ in members) and
+            manifest.is_current('bridged', base, sources, bridge_params, bridged_outputs)):
+        print(f"Unchanged, reusing counts for {base}")
+        report.skip(base, 'bridge', 'unchanged since the last run, counts reused')
+        return [base] + manifest.get('bridged', base)['counts']
+
+    stats = FileStats(base)
+    try:
+        with stats.stage('bridge'):
+            streams = [_half_stream(name, input_file, sessions, paths, stats, series, where)
+                       for name, input_file, paths in members]
+            widths = [len(series)] * len(streams)
+            if 'bridged' in outputs:
+                counts = bridge_to_file(streams, widths, bridged_file_path, start_time, end_time,
+                                        headers)
+            else:
+                counts = merge_streams(streams, widths, None, start_time, end_time)
+    except ValueError as e:
+        print(f"Skipping base '{base}'. Error: {e}")
+        report.fail(base, 'bridge', str(e))
+        return None
+    if 'bridged' in outputs:
+        stats.wrote(bridged_file_path)
+        print(f"Bridged file saved to {bridged_file_path}")
+
+    stats.events_per_box = counts
+    report.add_file(stats)
+    if manifest is not None:
+        manifest.record('bridged', base, sources, bridge_params, bridged_outputs, counts=counts)
+    return [base] + counts
@@ -0,0 +1,323 @@
+"""
+Raster and cumulative-record figures for whole cohorts.
+
+Every session gets one figure per kind, laid out as one panel per box:
+
+    raster      a tick for every response
+    cumulative  the cumulative record (responses so far against time)
+
+saved as <name>_<kind>.<format>, where <name> is the input's base name with
+a suffix for anything but a raw file (_events, _raster-ready, _final,
+_bridged), so the figures of one session drawn from several of its files do
+not overwrite each other.
+
+Sessions are read from raw MED-PC files, EVENTS files (.npz/.parquet/.feather)
+or the CSVs the scripts write (Raster ready, FINALOUTPUT, BRIDGEDFINALOUTPUT),
+or passed in as a parsed SessionEvents.  Each panel is drawn with a single
+artist (one line of ticks or one stepped line), not one artist per event, on
+the Agg canvas without pyplot, so rendering is headless and a figure costs
+about the same whatever the number of events.  The panel grid is built once
+per worker and refilled for every session, and sessions are rendered in
+parallel with sa_batch.
+
+    python sa_plots.py C:\\...\\BRIDGEDFINALOUTPUT --out C:\\...\\PLOTS --format png,svg --workers 8
+
+matplotlib (and with it NumPy) is only imported when a figure is drawn.
+"""
+import argparse
+import csv
+import math
+import os
+
+from medpc_parser import TICKS_PER_MINUTE, parse_medpc_file
+from sa_batch import run_batch
+from sa_columnar import EVENT_EXTENSIONS, read_events
+from sa_io import atomic_path
+
+TIME_HEADER = 'Absolute Time (minutes)'
+KINDS = ('raster', 'cumulative')
+FORMATS = ('png', 'svg', 'pdf')
+PANEL_COLUMNS = 4
+PANEL_SIZE = (3.2, 2.0)  # inches per panel
+# Summary tables written next to the bridged files, not sessions.
+SUMMARY_FILES = ('Final_Counts.csv', 'Binned_Counts.csv', 'Cohort_Counts.csv',
+                 'Learning_Curves.csv', 'Acquisition.csv')
+# Figure name suffix per kind of input (see input_kind).
+KIND_SUFFIXES = {'raw': '', 'events': '_events', 'raster-ready': '_raster-ready',
+                 'final': '_final', 'bridged': '_bridged'}
+
+
+# -- Event times ---------------------------------------------------------------
+def session_times(session, marks=(1, 2), first_box=1):
+    """
+    Per-box response times (minutes) of a SessionEvents: the events whose
+    code is in 'marks' ("Box n-1" by default).  Returns (labels, times).
+    """
+    labels = [f'Box {first_box + i}' for i in range(session.n_boxes)]
+    times = [[tick / TICKS_PER_MINUTE for tick, code in zip(ticks, codes) if code in marks]
+             for ticks, codes in zip(session.ticks, session.codes)]
+    return labels, times
+
+
+def csv_times(path):
+    """
+    Per-box response times from a raster-ready, FINALOUTPUT or bridged CSV:
+    every non-blank, non-zero cell of a box column.  In a raster-ready table
+    only the 'Box n-1' columns are used.  Returns (labels, times).
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        headers = next(reader)
+        columns = [i for i, h in enumerate(headers) if h.startswith('Box ') and not h.endswith(' Fraction')]
+        if any(h.endswith(' Fraction') for h in headers):
+            columns = [i for i in columns if headers[i].endswith('-1')]
+        times = [[] for _ in columns]
+        for row in reader:
+            time = None
+            for box_times, i in zip(times, columns):
+                if i < len(row) and row[i] not in ('', '0', '0.0'):
+                    if time is None:
+                        time = float(row[0])
+                    box_times.append(time)
+    return [headers[i] for i in columns], times
+
+
+def _is_table(path):
+    # The scripts' CSVs start with the time column; raw .csv exports do not.
+    with open(path, newline='') as f:
+        return f.readline().startswith(TIME_HEADER)
+
+
+def half_first_box(path):
+    """9 for a 9-16 file (a '_9-16' name or a 'files9-16' folder), else 1."""
+    folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return 9 if '_9-16' in os.path.basename(path) or folder.endswith('9-16') else 1
+
+
+def input_kind(path):
+    """
+    'raw', 'events', or for the scripts' CSVs (told apart by their headers)
+    'raster-ready' ('Box n Fraction'), 'final' ('Box n-x') or 'bridged' ('Box n').
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EVENT_EXTENSIONS:
+        return 'events'
+    if ext != '.csv' or not _is_table(path):
+        return 'raw'
+    with open(path, newline='') as f:
+        headers = next(csv.reader(f))
+    if any(h.endswith(' Fraction') for h in headers):
+        return 'raster-ready'
+    if any(h.startswith('Box ') and '-' in h for h in headers):
+        return 'final'
+    return 'bridged'
+
+
+def load_times(path, n_boxes=8, fractions=(1, 2, 6), marks=(1, 2)):
+    """(labels, times) of one file, read according to its type."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EVENT_EXTENSIONS:
+        return session_times(read_events(path), marks, half_first_box(path))
+    if ext == '.csv' and _is_table(path):
+        return csv_times(path)
+    session = parse_medpc_file(path, n_boxes=n_boxes, fractions=fractions)
+    return session_times(session, marks, half_first_box(path))
+
+
+# -- Drawing -------------------------------------------------------------------
+class PanelFigure:
+    """
+    A grid of box panels, one Line2D each, built once and refilled for every
+    session: building the axes costs more than drawing the events, so each
+    worker process keeps one figure per kind and panel count (see figure_for).
+
+    Raster ticks are a single line per panel with NaN breaks between the
+    ticks, which Agg draws as one path; the cumulative record is one stepped
+    line.
+    """
+
+    def __init__(self, kind, n_panels):
+        from matplotlib.figure import Figure
+
+        if kind not in KINDS:
+            raise ValueError(f"Unknown figure kind '{kind}' (use {', '.join(KINDS)})")
+        self.kind = kind
+        self.n_panels = n_panels
+        columns = min(PANEL_COLUMNS, max(n_panels, 1))
+        rows = math.ceil(max(n_panels, 1) / columns)
+        height = PANEL_SIZE[1] * rows + 0.9
+        self.figure = Figure(figsize=(PANEL_SIZE[0] * columns, height))
+        self.figure.subplots_adjust(left=0.06 if kind == 'cumulative' else 0.03, right=0.98,
+                                    bottom=0.55 / height, top=1 - 0.65 / height,
+                                    hspace=0.45, wspace=0.08)
+        axes = self.figure.subplots(rows, columns, squeeze=False).ravel()
+        for ax in axes[n_panels:]:
+            ax.set_visible(False)
+        self.axes = axes[:n_panels]
+        self.lines = []
+        for i, ax in enumerate(self.axes):
+            line, = ax.plot([], [], linewidth=0.6 if kind == 'raster' else 0.8, color='k',
+                            drawstyle='default' if kind == 'raster' else 'steps-post')
+            self.lines.append(line)
+            # Tick labels only on the outer panels.
+            ax.tick_params(labelsize=7, labelbottom=i + columns >= n_panels,
+                           labelleft=kind == 'cumulative' and i % columns == 0)
+            if kind == 'raster':
+                ax.set_yticks([])
+        self.figure.supxlabel('Time (minutes)', fontsize=9)
+        if kind == 'cumulative':
+            self.figure.supylabel('Responses', fontsize=9)
+        self.title = self.figure.suptitle('')
+
+    def fill(self, labels, times, start_time=0, end_time=None, title=None):
+        import numpy as np
+
+        end = _end_time(times, end_time)
+        top = 1.0
+        for ax, line, label, box_times in zip(self.axes, self.lines, labels, times):
+            t = np.asarray(box_times, dtype=float)
+            t = t[(t >= start_time) & (t <= end)]
+            if self.kind == 'raster':
+                x = np.repeat(t, 3)
+                x[2::3] = np.nan
+                y = np.tile([0.0, 1.0, np.nan], len(t))
+            else:
+                x = np.concatenate(([start_time], t, [end]))
+                y = np.concatenate(([0], np.arange(1, len(t) + 1), [len(t)]))
+                top = max(top, len(t) * 1.05)
+            line.set_data(x, y)
+            ax.set_title(f'{label} (n={len(t)})', fontsize=8)
+        for ax in self.axes:
+            ax.set_xlim(start_time, end)
+            ax.set_ylim(0, top)
+        self.title.set_text(title or '')
+
+    def save(self, path, dpi=100):
+        # The temporary name keeps the extension, which picks the format.
+        with atomic_path(path) as temp_path:
+            self.figure.savefig(temp_path, dpi=dpi)
+
+
+_figures = {}  # (kind, panels) -> PanelFigure, per process
+
+
+def figure_for(kind, n_panels):
+    """The PanelFigure of this process for 'kind' and 'n_panels' (built on first use)."""
+    key = (kind, n_panels)
+    if key not in _figures:
+        _figures[key] = PanelFigure(kind, n_panels)
+    return _figures[key]
+
+
+def _end_time(times, end_time):
+    if end_time is not None:
+        return end_time
+    return max((t[-1] for t in times if len(t)), default=1.0)
+
+
+# -- Rendering -----------------------------------------------------------------
+def render_session(labels, times, out_dir, name, kinds=KINDS, formats=('png',),
+                   start_time=0, end_time=None, dpi=100):
+    """Draws and saves every kind of figure of one session; returns the paths written."""
+    written = []
+    for kind in kinds:
+        figure = figure_for(kind, len(labels))
+        figure.fill(labels, times, start_time, end_time, title=name)
+        for fmt in formats:
+            path = os.path.join(out_dir, f'{name}_{kind}.{fmt}')
+            figure.save(path, dpi)
+            written.append(path)
+    return written
+
+
+def figure_name(input_file):
+    """The name the figures of 'input_file' are saved under (without kind and format)."""
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    if half_first_box(input_file) == 9 and '_9-16' not in name:
+        name += '_9-16'  # the raw 1-8 and 9-16 files share a name
+    return name + KIND_SUFFIXES[input_kind(input_file)]
+
+
+def render_file(input_file, out_dir, kinds=KINDS, formats=('png',), start_time=0, end_time=None,
+                n_boxes=8, fractions=(1, 2, 6), marks=(1, 2), dpi=100):
+    """Reads one file and renders its figures (the batch worker)."""
+    labels, times = load_times(input_file, n_boxes, fractions, marks)
+    name = figure_name(input_file)
+    written = render_session(labels, times, out_dir, name, kinds, formats, start_time, end_time, dpi)
+    print(f"Rendered {name} ({sum(len(t) for t in times)} responses, {len(labels)} boxes)")
+    return written
+
+
+def input_files(paths):
+    """The files of 'paths', with folders expanded to the files directly in them."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path))
+                         if os.path.isfile(os.path.join(path, f)) and f not in SUMMARY_FILES)
+        else:
+            files.append(path)
+    return files
+
+
+def render_cohort(paths, out_dir, kinds=KINDS, formats=('png',), start_time=0, end_time=None,
+                  n_boxes=8, fractions=(1, 2, 6), marks=(1, 2), dpi=100, workers=1):
+    """
+    Renders every session file under 'paths' into 'out_dir', 'workers'
+    sessions at a time.  Returns the paths written.
+    """
+    for kind in kinds:
+        if kind not in KINDS:
+            raise ValueError(f"Unknown figure kind '{kind}' (use {', '.join(KINDS)})")
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format '{fmt}' (use {', '.join(FORMATS)})")
+    os.makedirs(out_dir, exist_ok=True)
+    tasks, names = [], {}
+    for input_file in input_files(paths):
+        name = figure_name(input_file)
+        if name in names:
+            print(f"Skipping {input_file} because its figures would overwrite those of {names[name]}.")
+            continue
+        names[name] = input_file
+        tasks.append((input_file, out_dir, tuple(kinds), tuple(formats), start_time, end_time,
+                      n_boxes, tuple(fractions), tuple(marks), dpi))
+    written = []
+    for _, result, error in run_batch(render_file, tasks, max_workers=workers):
+        if error is None:
+            written.extend(result)
+    return written
+
+
+def parse_codes(text):
+    """Parses '1,2,6' into (1, 2, 6)."""
+    return tuple(int(x) for x in text.split(',') if x.strip())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render raster and cumulative-record figures, one panel per box.")
+    parser.add_argument('inputs', nargs='+',
+                        help="session files or folders: raw MED-PC files, EVENTS files or the scripts' CSVs")
+    parser.add_argument('--out', required=True, help="folder for the figures")
+    parser.add_argument('--kinds', default=','.join(KINDS),
+                        help=f"figures per session (default {','.join(KINDS)})")
+    parser.add_argument('--format', default='png', help="comma-separated: png, svg, pdf (default png)")
+    parser.add_argument('--start-time', type=float, default=0, help="minutes (default 0)")
+    parser.add_argument('--end-time', type=float, help="minutes (default: the last response)")
+    parser.add_argument('--boxes', type=int, default=8,
+                        help="raw files: boxes per file (default 8, 16 for the rat files)")
+    parser.add_argument('--fractions', type=parse_codes, default=(1, 2, 6),
+                        help="raw files: fraction codes to decode (default 1,2,6; 1 for the rat files)")
+    parser.add_argument('--marks', type=parse_codes, default=(1, 2),
+                        help="raw/EVENTS files: codes drawn as responses (default 1,2)")
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes (default 1)")
+    args = parser.parse_args()
+
+    written = render_cohort(args.inputs, args.out,
+                            [k.strip() for k in args.kinds.split(',') if k.strip()],
+                            [f.strip().lower() for f in args.format.split(',') if f.strip()],
+                            args.start_time, args.end_time, args.boxes, args.fractions,
+                            args.marks, args.dpi, args.workers)
+    print(f"Wrote {len(written)} figures to {args.out}")
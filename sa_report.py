@@ -0,0 +1,238 @@
+"""
+Run instrumentation for the processing scripts.
+
+Every run collects a RunReport: wall and CPU time per stage, and per file
+the time of each of its stages, bytes read and written and events decoded per
+box, plus every file that was skipped or failed and why.  Memory is the peak
+of the process that handled the file, from its start to the end of that file
+(the OS keeps no per-file peak): in batch mode a worker's files after its
+largest one all show that file's peak.
+The report can be saved as JSON (everything) or CSV (one row per file and
+stage) and a one-line summary is printed at the end of the run.
+
+Per-file numbers are measured where the file is processed, in a FileStats
+that the worker returns with its result, so they are right in batch mode
+too.  profile_call() runs the parse of a file under cProfile and dumps the
+stats to a .prof file; print_profiles() merges and prints them.
+"""
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from sa_io import atomic_path
+
+REPORT_VERSION = 2
+CSV_HEADERS = ['file', 'stage', 'status', 'reason', 'wall_seconds', 'cpu_seconds',
+               'bytes_read', 'bytes_written', 'events', 'events_per_box',
+               'worker_peak_memory_bytes']
+
+
+def peak_memory():
+    """Peak resident memory of this process so far, in bytes (None if unknown)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return _windows_peak_memory()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _windows_peak_memory():
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in (
+                           'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                           'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                           'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# -- Per-file measurements -----------------------------------------------------
+class FileStats:
+    """
+    Timings and sizes of one file (or one bridged base name).  Filled in by
+    the worker that processes it and sent back with its result.
+    """
+
+    def __init__(self, name, bytes_read=0):
+        self.name = name
+        self.bytes_read = bytes_read
+        self.bytes_written = 0
+        self.events_per_box = []
+        self.stages = {}  # stage -> [wall seconds, cpu seconds]
+        self.worker_peak_memory = None  # of the whole worker process so far, not this file
+
+    @classmethod
+    def for_input(cls, input_file):
+        return cls(input_file, _file_size(input_file))
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(stage, [0.0, 0.0])
+            totals[0] += time.perf_counter() - wall
+            totals[1] += time.process_time() - cpu
+            self.worker_peak_memory = peak_memory()
+
+    def read(self, path):
+        self.bytes_read += _file_size(path)
+
+    def wrote(self, path, size=None):
+        """Counts an output; 'size' if it is known (it may not be written yet)."""
+        self.bytes_written += _file_size(path) if size is None else size
+
+
+# -- Run report ----------------------------------------------------------------
+class RunReport:
+    """Everything measured during one run of a script."""
+
+    def __init__(self, script, params=None):
+        self.script = script
+        self.params = dict(params or {})
+        self.started = datetime.now()
+        self._wall, self._cpu = time.perf_counter(), time.process_time()
+        self.stages = {}     # main-process stages: stage -> [wall, cpu]
+        self.records = []    # one dict per file and stage (see CSV_HEADERS)
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Times a stage of the run as a whole (in this process)."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(stage, [0.0, 0.0])
+            totals[0] += time.perf_counter() - wall
+            totals[1] += time.process_time() - cpu
+
+    def add_file(self, stats, status='ok', reason=''):
+        """Adds one record per stage of a FileStats."""
+        for stage, (wall, cpu) in stats.stages.items():
+            self.records.append({
+                'file': stats.name, 'stage': stage, 'status': status, 'reason': reason,
+                'wall_seconds': wall, 'cpu_seconds': cpu,
+                # Bytes belong to the file, so they go on its first stage only.
+                'bytes_read': stats.bytes_read if stage == next(iter(stats.stages)) else 0,
+                'bytes_written': stats.bytes_written if stage == next(iter(stats.stages)) else 0,
+                'events': sum(stats.events_per_box),
+                'events_per_box': list(stats.events_per_box),
+                'worker_peak_memory_bytes': stats.worker_peak_memory,
+            })
+
+    def _note(self, name, stage, status, reason):
+        self.records.append({
+            'file': name, 'stage': stage, 'status': status, 'reason': reason,
+            'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'bytes_read': 0, 'bytes_written': 0,
+            'events': 0, 'events_per_box': [], 'worker_peak_memory_bytes': None,
+        })
+
+    def skip(self, name, stage, reason):
+        self._note(name, stage, 'skipped', reason)
+
+    def fail(self, name, stage, reason):
+        self._note(name, stage, 'failed', reason)
+
+    def count(self, status):
+        return len({(r['file'], r['stage']) for r in self.records if r['status'] == status})
+
+    def as_dict(self):
+        file_stages = {}
+        for r in self.records:
+            if r['status'] == 'ok':
+                totals = file_stages.setdefault(r['stage'], {'files': 0, 'wall_seconds': 0.0,
+                                                             'cpu_seconds': 0.0, 'events': 0})
+                totals['files'] += 1
+                totals['wall_seconds'] += r['wall_seconds']
+                totals['cpu_seconds'] += r['cpu_seconds']
+                totals['events'] += r['events']
+        return {
+            'version': REPORT_VERSION,
+            'script': self.script,
+            'params': self.params,
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_seconds': time.perf_counter() - self._wall,
+            'cpu_seconds': time.process_time() - self._cpu,
+            'peak_memory_bytes': peak_memory(),
+            'bytes_read': sum(r['bytes_read'] for r in self.records),
+            'bytes_written': sum(r['bytes_written'] for r in self.records),
+            'stages': {stage: {'wall_seconds': wall, 'cpu_seconds': cpu}
+                       for stage, (wall, cpu) in self.stages.items()},
+            'file_stages': file_stages,
+            'files': self.records,
+            'skipped': [r for r in self.records if r['status'] == 'skipped'],
+            'failed': [r for r in self.records if r['status'] == 'failed'],
+        }
+
+    def summary(self):
+        report = self.as_dict()
+        stages = ', '.join(f"{stage} {s['wall_seconds']:.1f} s" for stage, s in report['stages'].items())
+        stages = f" ({stages})" if stages else ''
+        ok = len({r['file'] for r in self.records if r['status'] == 'ok'})
+        return (f"Run finished in {report['wall_seconds']:.1f} s{stages}: "
+                f"{ok} ok, {self.count('skipped')} skipped, {self.count('failed')} failed")
+
+    def save(self, path):
+        """Writes the report as JSON, or as CSV (one row per file and stage) for a .csv path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with atomic_path(path) as temp_path:
+            if path.lower().endswith('.csv'):
+                with open(temp_path, 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=CSV_HEADERS)
+                    writer.writeheader()
+                    for r in self.records:
+                        writer.writerow(dict(r, events_per_box=';'.join(map(str, r['events_per_box']))))
+            else:
+                with open(temp_path, 'w') as f:
+                    json.dump(self.as_dict(), f, indent=1)
+        print(f"Run report saved to {path}")
+
+
+# -- Profiling -----------------------------------------------------------------
+def profile_call(profile_path, func, *args, **kwargs):
+    """Runs func(*args, **kwargs) under cProfile, dumps the stats to 'profile_path'."""
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+
+
+def print_profiles(profile_paths, limit=20):
+    """Prints the merged cProfile stats of several .prof files, by cumulative time."""
+    profile_paths = [p for p in profile_paths if os.path.isfile(p)]
+    if not profile_paths:
+        return
+    import pstats
+
+    stats = pstats.Stats(*profile_paths)
+    stats.sort_stats('cumulative').print_stats(limit)
@@ -0,0 +1,402 @@
+"""
+Sharded runs: several worker processes, on one machine or several, share
+the mouse workflow of one SAD folder without overwriting each other.
+
+Workers never talk to each other; they coordinate through files in a shared
+work directory:
+
+    claims/<key>/<n>.claim  generation n of the claim on <key>: created with
+                            O_EXCL, so only one worker gets it, touched every
+                            lease/3 seconds while the work runs and set back
+                            to time 0 when it is released
+    done/<key>.json         written (atomically) once <key> is finished, with
+                            the signature of its inputs and its result
+
+There is one key per raw file ('file-<name>') and one per base name
+('bridge-<base>').  A worker takes any raw file without a current done
+marker or a live claim, parses it and writes its per-file outputs; a base
+name is bridged and counted once the done markers of all its halves (1-8
+and 9-16) are current.  Final_Counts.csv is written once, under a claim of
+its own, by the first worker that finds everything done.
+
+A key is free when its newest claim is released or has not been touched for
+'lease' seconds (its worker died); it is taken by creating the next
+generation, which again only one worker can do.  Claim files are never
+renamed or reused, so a worker acting on what it listed a moment ago cannot
+take away a newer claim: it fails to create a generation that exists, and
+gives back one that turns out older than the newest.
+
+Every output is written under a temporary name and renamed into place (see
+sa_io), and the same inputs always give the same bytes, so even work done
+twice (e.g. a claim a sync client delivered late) ends in the same files.
+OneDrive only shows a claim file to the other machines after it has synced;
+with several machines, put the work directory on a network share and keep
+their clocks within a minute of each other.
+
+Try it with several local processes on one folder (with 'files' and
+'files9-16'):
+
+    python sa_shard.py C:\\temp\\synthetic --spawn 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from sa_io import atomic_write
+from sa_manifest import normalize_params
+from sa_pipeline import (DEFAULT_OUTPUTS, FINAL_SERIES, bridge_base, bridged_label,
+                         output_paths, parse_series, process_mouse_file)
+from sa_bridge import write_counts
+from sa_report import RunReport
+
+DEFAULT_LEASE = 300  # seconds without a heartbeat before a claim expires
+DEFAULT_POLL = 5     # seconds between passes while other workers hold the rest
+
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def default_worker_id():
+    import socket
+
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkDir:
+    """
+    The claims and done markers of one shared work directory, seen by one
+    worker.  Use as a context manager: the heartbeat that keeps this
+    worker's claims alive runs while it is open.
+    """
+
+    def __init__(self, path, worker_id=None, lease=DEFAULT_LEASE):
+        self.path = path
+        self.worker_id = worker_id or default_worker_id()
+        self.lease = lease
+        self.claims_dir = os.path.join(path, 'claims')
+        self.done_dir = os.path.join(path, 'done')
+        os.makedirs(self.claims_dir, exist_ok=True)
+        os.makedirs(self.done_dir, exist_ok=True)
+        self._held = {}  # key -> (generation, claim path)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._heartbeat.join()
+        with self._lock:
+            held = list(self._held)
+        for key in held:
+            self.release(key)
+
+    def _claim_path(self, key, generation):
+        return os.path.join(self.claims_dir, key, f'{generation}.claim')
+
+    def _done_path(self, key):
+        return os.path.join(self.done_dir, key + '.json')
+
+    # -- Claims ----------------------------------------------------------------
+    def _generations(self, key):
+        try:
+            names = os.listdir(os.path.join(self.claims_dir, key))
+        except FileNotFoundError:
+            return []
+        return sorted(int(n[:-len('.claim')]) for n in names
+                      if n.endswith('.claim') and n[:-len('.claim')].isdigit())
+
+    def _beat(self):
+        while not self._stop.wait(self.lease / 3):
+            # Under the lock, so a claim released meanwhile is not touched again.
+            with self._lock:
+                for key, (generation, path) in self._held.items():
+                    if os.path.exists(self._claim_path(key, generation + 1)):
+                        print(f"Warning: claim {key} was taken over by another worker")
+                        continue
+                    try:
+                        os.utime(path)
+                    except FileNotFoundError:
+                        print(f"Warning: claim {key} was removed by another worker")
+
+    def claim(self, key):
+        """True if this worker now holds 'key' (a released or expired claim is taken over)."""
+        generations = self._generations(key)
+        generation, expired = 0, None
+        if generations:
+            newest = self._claim_path(key, generations[-1])
+            try:
+                mtime = os.stat(newest).st_mtime
+            except FileNotFoundError:  # only older generations are removed; list again later
+                return False
+            age = time.time() - mtime
+            if age < self.lease:
+                return False
+            generation = generations[-1] + 1
+            if mtime > 0:
+                expired = (newest, age)
+
+        path = self._claim_path(key, generation)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:  # another worker took this generation first
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'worker': self.worker_id, 'claimed': time.time()}, f)
+        if self._generations(key)[-1] != generation:
+            # Listed before a newer claim was made (and older ones removed): give it back.
+            os.utime(path, (0, 0))
+            return False
+
+        if expired is not None:
+            try:
+                with open(expired[0], 'r', encoding='utf-8') as f:
+                    owner = json.load(f).get('worker', '?')
+            except (OSError, ValueError):
+                owner = '?'
+            print(f"Claim {key} of worker {owner} expired "
+                  f"({expired[1]:.0f} s without a heartbeat), taking it over")
+        for old in generations:
+            try:
+                os.remove(self._claim_path(key, old))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._held[key] = (generation, path)
+        return True
+
+    def release(self, key):
+        """Gives 'key' back: its claim is set to time 0, so the next claim takes it at once."""
+        with self._lock:
+            held = self._held.pop(key, None)
+            if held is None:
+                return
+            try:
+                os.utime(held[1], (0, 0))
+            except FileNotFoundError:
+                pass
+
+    # -- Done markers ----------------------------------------------------------
+    def done(self, key):
+        """The done marker of 'key' as a dict, or None."""
+        try:
+            with open(self._done_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_done(self, key, signature):
+        """The done marker of 'key' if it was written for 'signature', else None."""
+        marker = self.done(key)
+        if marker is not None and marker.get('signature') == signature:
+            return marker
+        return None
+
+    def mark_done(self, key, signature, **result):
+        atomic_write(self._done_path(key),
+                     json.dumps(dict(result, signature=signature, worker=self.worker_id)))
+
+
+# -- Worker --------------------------------------------------------------------
+def run_sharded(halves, dirs, work_dir, outputs=DEFAULT_OUTPUTS, start_time=0, end_time=180,
+                where=None, series=FINAL_SERIES, worker_id=None, lease=DEFAULT_LEASE,
+                poll=DEFAULT_POLL, report=None):
+    """
+    Runs one worker of a sharded run of the mouse workflow (see the module
+    docstring) until every raw file and base name is done, by this worker
+    or others.  Arguments as for sa_pipeline.run_mouse_pipeline, plus the
+    shared 'work_dir'.  Returns the counts rows, one per bridged base name.
+    """
+    series = [tuple(s) for s in series]
+    if report is None:
+        report = RunReport('sharded mouse pipeline')
+    outputs = tuple(outputs)
+    for stage in outputs:
+        os.makedirs(dirs['bridged' if stage == 'counts' else stage], exist_ok=True)
+
+    file_params = {'species': 'mouse', 'boxes': 8, 'outputs': list(outputs), 'where': where,
+                   'series': series}
+    inputs = []  # (name, input_file, paths, params) in listing order per half
+    by_base = {}
+    for input_directory, suffix in halves:
+        for file_name in os.listdir(input_directory):
+            input_file = os.path.join(input_directory, file_name)
+            if not os.path.isfile(input_file):
+                continue
+            base = os.path.splitext(file_name)[0]
+            name = base + suffix
+            paths = output_paths(name, dirs, outputs)
+            params = normalize_params(dict(file_params, suffix=suffix))
+            inputs.append((name, input_file, paths, params))
+            by_base.setdefault(base, []).append((name, input_file, paths))
+    for base, members in list(by_base.items()):
+        if len(members) != len(halves):
+            print(f"Skipping base '{base}' because it does not have exactly {len(halves)} matching files.")
+            report.skip(base, 'bridge', f"{len(members)} of {len(halves)} halves present")
+            del by_base[base]
+
+    bridge_params = normalize_params({'start_time': start_time, 'end_time': end_time,
+                                      'outputs': list(outputs), 'series': series})
+    headers = [bridged_label(box + 8 * h, fraction)
+               for h in range(len(halves)) for box, fraction in series]
+
+    def current(key, signature, paths):
+        # Done for these inputs, and its outputs are still there.
+        marker = work.is_done(key, signature)
+        if marker is not None and all(os.path.isfile(p) for p in paths):
+            return marker
+        return None
+
+    with WorkDir(work_dir, worker_id, lease) as work:
+        print(f"Worker {work.worker_id} started on {work_dir}")
+        while True:
+            waiting = False
+
+            # -- Raw files: parse and write the per-file outputs ------------------
+            signatures = {}
+            for name, input_file, paths, params in inputs:
+                key = 'file-' + name
+                try:
+                    signature = {'source': _signature(input_file), 'params': params}
+                except FileNotFoundError:
+                    continue
+                signatures[name] = signature
+                if current(key, signature, paths.values()):
+                    continue
+                if not work.claim(key):
+                    waiting = True  # another worker has it
+                    continue
+                try:
+                    if current(key, signature, paths.values()):
+                        continue  # finished by another worker in the meantime
+                    try:
+                        _, stats = process_mouse_file(input_file, paths, None, where, series)
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                        print(f"Failed to process {input_file}. Error: {error}")
+                        report.fail(input_file, 'parse', error)
+                        work.mark_done(key, signature, error=error)
+                    else:
+                        report.add_file(stats)
+                        work.mark_done(key, signature)
+                finally:
+                    work.release(key)
+
+            # -- Base names: bridge and count once all halves are done --------------
+            count_rows = []
+            for base, members in by_base.items():
+                if any(name not in signatures for name, _, _ in members):
+                    continue  # a raw file was removed during the run
+                markers = [current('file-' + name, signatures.get(name), paths.values())
+                           for name, _, paths in members]
+                if not all(markers):
+                    waiting = True
+                    continue
+                if any('error' in marker for marker in markers):
+                    continue  # reported by the worker that tried it
+                key = 'bridge-' + base
+                signature = {'halves': [signatures[name] for name, _, _ in members],
+                             'params': bridge_params}
+                bridged = [os.path.join(dirs['bridged'], base + '.csv')] if 'bridged' in outputs else []
+                marker = current(key, signature, bridged)
+                if marker is None and work.claim(key):
+                    try:
+                        marker = current(key, signature, bridged)
+                        if marker is None:
+                            row = bridge_base(base, members, len(halves), {}, set(), dirs, outputs,
+                                              start_time, end_time, None, bridge_params, report,
+                                              series, headers, where)
+                            work.mark_done(key, signature, row=row)
+                            marker = {'row': row}
+                    finally:
+                        work.release(key)
+                if marker is None:
+                    waiting = True
+                elif marker.get('row') is not None:
+                    count_rows.append(marker['row'])
+
+            if not waiting:
+                break
+            time.sleep(poll)
+
+        # -- Everything is done: Final_Counts.csv, written by one worker ----------
+        if 'counts' in outputs:
+            final_counts_path = os.path.join(dirs['bridged'], 'Final_Counts.csv')
+            signature = hashlib.sha1(json.dumps([headers, count_rows]).encode('utf-8')).hexdigest()
+            while not current('final-counts', signature, [final_counts_path]):
+                if not work.claim('final-counts'):
+                    time.sleep(poll)  # another worker is writing it
+                    continue
+                try:
+                    if not current('final-counts', signature, [final_counts_path]):
+                        write_counts(final_counts_path, count_rows, headers=headers)
+                        work.mark_done('final-counts', signature)
+                        print(f"Final counts saved to {final_counts_path}")
+                finally:
+                    work.release('final-counts')
+    return count_rows
+
+
+def spawn_workers(n_workers, argv):
+    """Starts 'n_workers' local worker processes of this module with 'argv'; returns their exit codes."""
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__)] + argv +
+                                  ['--worker-id', f'local-{i + 1}'])
+                 for i in range(n_workers)]
+    return [p.wait() for p in processes]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one worker (or several local ones) of a sharded "
+                                                 "mouse run over a folder with 'files' and 'files9-16'.")
+    parser.add_argument('root', help="folder with 'files' and 'files9-16'; outputs go to its "
+                                     "FINALOUTPUT and BRIDGEDFINALOUTPUT folders")
+    parser.add_argument('--work-dir', help="shared folder for claims and done markers (default ROOT/SHARD)")
+    parser.add_argument('--outputs', default=','.join(DEFAULT_OUTPUTS),
+                        help=f"outputs to write (default {','.join(DEFAULT_OUTPUTS)})")
+    parser.add_argument('--series',
+                        help="FINALOUTPUT series as box-fraction pairs (default: fraction 1 of every box)")
+    parser.add_argument('--start-time', type=float, default=0, help="minutes (default 0)")
+    parser.add_argument('--end-time', type=float, default=180, help="minutes (default 180)")
+    parser.add_argument('--worker-id', help="name of this worker in claims (default host-pid)")
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE,
+                        help=f"seconds before the claim of a silent worker expires (default {DEFAULT_LEASE})")
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL,
+                        help=f"seconds between checks while other workers finish (default {DEFAULT_POLL})")
+    parser.add_argument('--spawn', type=int, default=0,
+                        help="start this many local worker processes instead and wait for them")
+    args = parser.parse_args()
+
+    if args.spawn:
+        argv = [args.root, '--outputs', args.outputs, '--start-time', str(args.start_time),
+                '--end-time', str(args.end_time), '--lease', str(args.lease), '--poll', str(args.poll)]
+        if args.work_dir:
+            argv += ['--work-dir', args.work_dir]
+        if args.series:
+            argv += ['--series', args.series]
+        codes = spawn_workers(args.spawn, argv)
+        print(f"{args.spawn} workers finished (exit codes {codes})")
+        sys.exit(max(codes))
+
+    dirs = {stage: os.path.join(args.root, folder) for stage, folder in
+            (('aligned', 'SA Data to process'), ('raster', 'Raster ready'), ('final', 'FINALOUTPUT'),
+             ('events', 'EVENTS'), ('bridged', 'BRIDGEDFINALOUTPUT'))}
+    halves = [(os.path.join(args.root, 'files'), ''), (os.path.join(args.root, 'files9-16'), '_9-16')]
+    report = RunReport('sa_shard', {'worker': args.worker_id})
+    run_sharded(halves, dirs, args.work_dir or os.path.join(args.root, 'SHARD'),
+                [o.strip() for o in args.outputs.split(',') if o.strip()],
+                args.start_time, args.end_time,
+                series=parse_series(args.series) if args.series else FINAL_SERIES,
+                worker_id=args.worker_id, lease=args.lease, poll=args.poll, report=report)
+    print(report.summary())
@@ -0,0 +1,97 @@
+"""
+Watch mode: process session files as MED-PC finishes writing them.
+
+A plain polling loop over local folders, no extra services.  Every
+'interval' seconds the folders are listed and each file's (size, mtime) is
+compared with the last poll.  A file counts as finished once it has not
+changed for 'settle' seconds; new or changed finished files are handed to a
+callback together with the files that are still being written, so the
+callback can leave those alone until a later poll.
+
+    watch_folders([input_dir], handle, interval=10, settle=30)
+
+runs until Ctrl+C.
+"""
+import os
+import time
+
+
+class FolderWatch:
+    """Tracks the files of some folders and reports those that are new and stable."""
+
+    def __init__(self, directories, settle=30):
+        self.directories = list(directories)
+        self.settle = settle
+        self.seen = {}   # path -> (signature, time the signature was first seen)
+        self.done = {}   # path -> signature it was last handled at
+
+    def scan(self):
+        files = {}
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            for file_name in os.listdir(directory):
+                path = os.path.join(directory, file_name)
+                try:
+                    st = os.stat(path)
+                except OSError:  # removed while listing
+                    continue
+                if os.path.isfile(path):
+                    files[path] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    def poll(self, now=None):
+        """
+        Returns (ready, pending): files whose signature has been stable for
+        'settle' seconds and was not handled yet, and files still changing.
+        """
+        now = time.monotonic() if now is None else now
+        files = self.scan()
+        for path in list(self.seen):
+            if path not in files:
+                del self.seen[path]
+                self.done.pop(path, None)
+
+        ready, pending = [], []
+        for path, signature in files.items():
+            previous = self.seen.get(path)
+            if previous is None or previous[0] != signature:
+                self.seen[path] = (signature, now)
+                pending.append(path)
+            elif now - previous[1] < self.settle:
+                pending.append(path)
+            elif self.done.get(path) != signature:
+                ready.append(path)
+        return sorted(ready), sorted(pending)
+
+    def mark_done(self, paths):
+        for path in paths:
+            if path in self.seen:
+                self.done[path] = self.seen[path][0]
+
+
+def watch_folders(directories, handle, interval=10, settle=30):
+    """
+    Polls 'directories' every 'interval' seconds and calls
+    handle(ready, pending) whenever finished files are new or changed.
+    'ready' files are marked handled once handle() returns; if it raises, the
+    error is printed and they are offered again on the next poll.
+    """
+    watch = FolderWatch(directories, settle)
+    print(f"Watching {', '.join(directories)} (every {interval:g} s, "
+          f"files are processed once unchanged for {settle:g} s). Press Ctrl+C to stop.")
+    try:
+        while True:
+            ready, pending = watch.poll()
+            if ready:
+                print(f"{time.strftime('%H:%M:%S')} {len(ready)} finished file(s): "
+                      f"{', '.join(os.path.basename(p) for p in ready)}")
+                try:
+                    handle(ready, pending)
+                except Exception as e:
+                    print(f"Processing failed, will retry. Error: {type(e).__name__}: {e}")
+                else:
+                    watch.mark_done(ready)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching.")